@@ -0,0 +1,59 @@
+import os
+import random
+import sys
+import time
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from paint import commands
+from paint.document import Document
+from paint.executor import TileExecutor
+
+
+OPS = [
+    ("rotate", ("transpose", Image.ROTATE_270)),
+    ("flip_h", ("transpose", Image.FLIP_LEFT_RIGHT)),
+    ("blur", ("filter", "blur")),
+    ("sharpen", ("filter", "sharpen")),
+]
+
+
+def canvas(size):
+    # Shapes everywhere, so every tile is allocated and does real work.
+    document = Document((size, size), history=False)
+    rng = random.Random(3)
+    for _ in range(200):
+        x, y = rng.randrange(size), rng.randrange(size)
+        document.apply(commands.Shape("circle3d", x, y, x + size // 8, y + size // 8, "red", 3))
+    return document.image
+
+
+def seconds(executor, image, op, repeat):
+    executor.run(image, op)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        executor.run(image, op)
+    return (time.perf_counter() - start) / repeat
+
+
+def main(size=4096, repeat=3):
+    image = canvas(size)
+    counts = [1, 2, 4, 8]
+    print(f"{size}x{size}, {os.cpu_count()} CPU(s)")
+    print(f"{'op':<10}{'pool':<9}" + "".join(f"{n:>3} workers" for n in counts))
+    for name, op in OPS:
+        for processes in (False, True):
+            times = []
+            for workers in counts:
+                executor = TileExecutor(workers, processes=processes)
+                times.append(seconds(executor, image, op, repeat))
+                executor.shutdown()
+            row = "".join(f"{times[0] / t:>10.2f}x" for t in times)
+            print(f"{name:<10}{'process' if processes else 'thread':<9}{row}   "
+                  f"(1 worker: {times[0] * 1000:.0f} ms)")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+
+from PIL import Image, ImageColor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from paint import raster
+
+
+# The pre-batching path: one putpixel and one colour lookup per pixel.
+def per_pixel_line(image, x0, y0, x1, y1, color):
+    dx = abs(x1 - x0)
+    dy = abs(y1 - y0)
+    sx = 1 if x0 < x1 else -1
+    sy = 1 if y0 < y1 else -1
+    err = dx - dy
+    while True:
+        image.putpixel((x0, y0), ImageColor.getrgb(color))
+        if x0 == x1 and y0 == y1:
+            break
+        e2 = 2 * err
+        if e2 > -dy:
+            err -= dy
+            x0 += sx
+        if e2 < dx:
+            err += dx
+            y0 += sy
+
+
+def per_pixel_circle(image, xc, yc, r, color):
+    def plot(x, y):
+        for px, py in [(xc + x, yc + y), (xc - x, yc + y), (xc + x, yc - y), (xc - x, yc - y),
+                       (xc + y, yc + x), (xc - y, yc + x), (xc + y, yc - x), (xc - y, yc - x)]:
+            if 0 <= px < image.width and 0 <= py < image.height:
+                image.putpixel((px, py), ImageColor.getrgb(color))
+
+    x, y, p = 0, r, 1 - r
+    plot(x, y)
+    while x < y:
+        x += 1
+        if p < 0:
+            p += 2 * x + 1
+        else:
+            y -= 1
+            p += 2 * (x - y) + 1
+        plot(x, y)
+
+
+def throughput(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return repeat / (time.perf_counter() - start)
+
+
+def main(size=2000, repeat=20):
+    image = Image.new("RGB", (size, size), "white")
+    color = "black"
+    rgb = ImageColor.getrgb(color)
+    cases = [
+        ("line", lambda: per_pixel_line(image, 0, 0, size - 1, size // 3, color),
+         lambda: raster.draw_line(image, 0, 0, size - 1, size // 3, rgb)),
+        ("circle", lambda: per_pixel_circle(image, size // 2, size // 2, size // 3, color),
+         lambda: raster.draw_circle(image, size // 2, size // 2, size // 3, rgb)),
+        ("line w=9", None,
+         lambda: raster.draw_line(image, 0, 0, size - 1, size // 3, rgb, 9)),
+        ("circle w=9", None,
+         lambda: raster.draw_circle(image, size // 2, size // 2, size // 3, rgb, 9)),
+    ]
+    print(f"{'primitive':<12}{'per-pixel ops/s':>18}{'batched ops/s':>16}{'speedup':>10}")
+    for name, old, new in cases:
+        new_rate = throughput(new, repeat)
+        if old is None:
+            print(f"{name:<12}{'-':>18}{new_rate:>16.1f}{'-':>10}")
+            continue
+        old_rate = throughput(old, max(1, repeat // 4))
+        print(f"{name:<12}{old_rate:>18.1f}{new_rate:>16.1f}{new_rate / old_rate:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
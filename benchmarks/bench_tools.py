@@ -0,0 +1,309 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import time
+
+import PIL
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from paint import commands
+from paint.document import Document
+from paint.raster import np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# Each case builds a document for one canvas size and returns (prepare, op): prepare(i)
+# runs untimed before every op(i), which is the part that is measured.
+CASES = {}
+
+
+def case(name):
+    def register(fn):
+        CASES[name] = fn
+        return fn
+    return register
+
+
+def shapes(size, count, seed=1):
+    rng = random.Random(seed)
+    return [(rng.randrange(size), rng.randrange(size), rng.randrange(size), rng.randrange(size))
+            for _ in range(count)]
+
+
+def nothing(i):
+    pass
+
+
+@case("pencil")
+def pencil(size):
+    document = Document((size, size))
+    rng = random.Random(2)
+    strokes = []
+    for _ in range(8):
+        # A random walk in mouse-motion sized steps.
+        x, y = rng.randrange(size), rng.randrange(size)
+        points = []
+        for _ in range(200):
+            x = min(size - 1, max(0, x + rng.randint(-8, 8)))
+            y = min(size - 1, max(0, y + rng.randint(-8, 8)))
+            points.append((x, y))
+        strokes.append(points)
+
+    def op(i):
+        points = strokes[i % len(strokes)]
+        document.begin_stroke(*points[0], "black", 5)
+        for n, (x, y) in enumerate(points[1:]):
+            document.extend_stroke(x, y)
+            # Roughly what the 16 ms flush timer sees while dragging.
+            if n % 8 == 7:
+                document.flush_stroke()
+        document.end_stroke()
+    return nothing, op
+
+
+def shape_case(tool):
+    def build(size):
+        document = Document((size, size))
+        boxes = shapes(size, 64)
+
+        def op(i):
+            x0, y0, x1, y1 = boxes[i % len(boxes)]
+            if tool in ["circle_midpoint", "circle3d"]:
+                x1, y1 = x0 + (x1 - x0) // 4, y0 + (y1 - y0) // 4
+            document.apply(commands.Shape(tool, x0, y0, x1, y1, "red", 5))
+        return nothing, op
+    return build
+
+
+for _tool in ["line_bresenham", "circle_midpoint", "rectangle3d", "circle3d", "triangle3d"]:
+    case(_tool)(shape_case(_tool))
+
+
+def stamp_case(tool):
+    # The same shape stamped across the canvas, as when repeating a shape by hand.
+    def build(size):
+        document = Document((size, size))
+        step = max(1, (size - 96) // 8)
+
+        def op(i):
+            x0, y0 = 16 + i % 8 * step, 16 + i // 8 % 8 * step
+            document.apply(commands.Shape(tool, x0, y0, x0 + 64, y0 + 48, "red", 5))
+        return nothing, op
+    return build
+
+
+for _tool in ["circle_midpoint", "line_bresenham", "rectangle3d"]:
+    case("stamp_" + _tool)(stamp_case(_tool))
+
+
+@case("fill")
+def fill_case(size):
+    document = Document((size, size))
+    step = max(16, size // 8)
+    for x in range(0, size // 2, step):
+        document.apply(commands.Shape("rectangle", x, x, size - x, size - x, "black", 3))
+
+    def op(i):
+        document.apply(commands.Fill(size // 2, size // 2, "blue" if i % 2 else "yellow"))
+    return nothing, op
+
+
+@case("rotate")
+def rotate_case(size):
+    document = Document((size, size))
+    for x0, y0, x1, y1 in shapes(size, 16):
+        document.apply(commands.Shape("rectangle3d", x0, y0, x1, y1, "red", 5))
+
+    def op(i):
+        document.apply(commands.Rotate())
+    return nothing, op
+
+
+def flip_case(axis):
+    def build(size):
+        document = Document((size, size))
+        for x0, y0, x1, y1 in shapes(size, 16):
+            document.apply(commands.Shape("triangle3d", x0, y0, x1, y1, "green", 5))
+
+        def op(i):
+            document.apply(commands.Flip(axis))
+        return nothing, op
+    return build
+
+
+case("flip_h")(flip_case("horizontal"))
+case("flip_v")(flip_case("vertical"))
+
+
+def select_case(angle, scale):
+    # The TransformSelection a floating selection commits, moved back and forth.
+    def build(size):
+        document = Document((size, size))
+        for x0, y0, x1, y1 in shapes(size, 16):
+            document.apply(commands.Shape("circle3d", x0, y0, x0 + 40, y0 + 40, "purple", 5))
+        q = size // 4
+
+        def op(i):
+            dx = 16 if i % 2 == 0 else -16
+            x = q + (16 if i % 2 else 0)
+            document.apply(commands.TransformSelection((x, q, x + 2 * q, 3 * q), dx, dx,
+                                                       angle, scale, scale))
+        return nothing, op
+    return build
+
+
+case("select_move")(select_case(0.0, 1.0))
+case("select_transform")(select_case(30.0, 0.8))
+
+
+@case("undo")
+def undo_case(size):
+    document = Document((size, size))
+    boxes = shapes(size, 64)
+
+    def prepare(i):
+        x0, y0, x1, y1 = boxes[i % len(boxes)]
+        document.apply(commands.Shape("rectangle3d", x0, y0, x1, y1, "orange", 5))
+
+    def op(i):
+        document.apply(commands.Undo())
+    return prepare, op
+
+
+@case("update_canvas_image")
+def display_case(size):
+    # The part of Display.flush() that does not need Tk: recompositing and cropping each
+    # dirty tile and producing the bytes handed to PhotoImage.paste().
+    document = Document((size, size))
+    boxes = shapes(size, 64)
+    tile = 256
+
+    def prepare(i):
+        x0, y0, x1, y1 = boxes[i % len(boxes)]
+        document.apply(commands.Shape("rectangle", x0, y0, x1, y1, "navy", 5))
+
+    def op(i):
+        x0, y0, x1, y1 = boxes[i % len(boxes)]
+        for ty in range(max(0, y0 - 16) // tile, min(size - 1, y1 + 16) // tile + 1):
+            for tx in range(max(0, x0 - 16) // tile, min(size - 1, x1 + 16) // tile + 1):
+                box = (tx * tile, ty * tile, min(size, tx * tile + tile), min(size, ty * tile + tile))
+                document.layers.crop(box).tobytes()
+    return prepare, op
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes.
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def run_case(name, size, repeat):
+    prepare, op = CASES[name](size)
+    start_rss = peak_rss_kb()
+    latencies = []
+    for i in range(repeat):
+        prepare(i)
+        start = time.perf_counter()
+        op(i)
+        latencies.append(time.perf_counter() - start)
+    peak = peak_rss_kb()
+    return {
+        "case": name,
+        "size": size,
+        "ops": repeat,
+        "ops_per_sec": repeat / sum(latencies),
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "peak_rss_kb": None if peak is None else peak - start_rss,
+    }
+
+
+def run(names, sizes, repeat, isolate=True):
+    results = {}
+    for size in sizes:
+        for name in names:
+            if isolate:
+                # A fresh process per case keeps the peak RSS high-water mark meaningful.
+                with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+                    result = pool.apply(run_case, (name, size, repeat))
+            else:
+                result = run_case(name, size, repeat)
+            results[f"{name}@{size}"] = result
+            print(f"{name:<20}{size:>6}{result['ops_per_sec']:>12.1f}{result['p50_ms']:>10.2f}"
+                  f"{result['p99_ms']:>10.2f}{result['peak_rss_kb'] or 0:>12}")
+    return results
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print(f"\n{'case':<26}{'baseline ops/s':>16}{'now ops/s':>12}{'change':>10}")
+    for key, result in results.items():
+        old = baseline.get(key)
+        if old is None:
+            continue
+        change = result["ops_per_sec"] / old["ops_per_sec"] - 1
+        flag = "  REGRESSION" if change < -threshold else ""
+        print(f"{key:<26}{old['ops_per_sec']:>16.1f}{result['ops_per_sec']:>12.1f}{change:>+9.0%}{flag}")
+        if flag:
+            regressions.append(key)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every tool and transform headlessly.")
+    parser.add_argument("--sizes", default="512,1024,2048", help="comma separated square canvas sizes")
+    parser.add_argument("--cases", default=",".join(CASES), help="comma separated case names")
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="ops/s drop that counts as a regression (default 0.10)")
+    parser.add_argument("--inline", action="store_true",
+                        help="run every case in this process (faster, peak memory is cumulative)")
+    args = parser.parse_args(argv)
+
+    names = [name for name in args.cases.split(",") if name]
+    unknown = [name for name in names if name not in CASES]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    print(f"{'case':<20}{'size':>6}{'ops/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'peak KB':>12}")
+    results = run(names, sizes, args.repeat, isolate=not args.inline)
+    report = {
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "numpy": np.__version__ if np is not None else None,
+        "machine": platform.machine(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)["results"]
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
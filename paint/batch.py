@@ -0,0 +1,139 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+from PIL import Image
+
+from paint import commands, saving
+from paint.document import Document
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif", ".tif", ".tiff")
+
+# Set once per worker by the pool initializer, so the script is not pickled per file.
+_script = None
+_options = None
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes.
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def inputs(directory):
+    # A generator, so the pool starts on the first files while the rest are still listed.
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(EXTENSIONS):
+                yield entry.path
+
+
+def output_path(path, output_dir, format, used=()):
+    # a.png and a.jpg would both become a.png; the later one keeps its source extension
+    # in the name (a-jpg.png) instead of overwriting the first.
+    name, source = os.path.splitext(os.path.basename(path))
+    extension = next(ext for ext, fmt in saving.FORMATS.items() if fmt == format)
+    target = os.path.join(output_dir, f"{name}.{extension}")
+    number = 1
+    while target in used:
+        suffix = source.lstrip(".").lower() + (f"-{number}" if number > 1 else "")
+        target = os.path.join(output_dir, f"{name}-{suffix}.{extension}")
+        number += 1
+    return target
+
+
+def jobs(paths, output_dir, format):
+    # Targets are assigned here, in the parent, so no two workers write the same file.
+    used = set()
+    for path in paths:
+        target = output_path(path, output_dir, format, used)
+        used.add(target)
+        yield path, target
+
+
+def start_worker(script, options, max_memory_mb):
+    global _script, _options
+    _script, _options = script, options
+    if max_memory_mb and resource is not None:
+        # Address space rather than RSS: it is the limit Linux enforces, and a worker that
+        # hits it gets a MemoryError for that file instead of taking the machine down.
+        limit = max_memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def process(job):
+    path, target = job
+    start = time.perf_counter()
+    try:
+        # Opening only reads the header; pixels are decoded here, in the worker.
+        with Image.open(path) as image:
+            needs_history = any(isinstance(c, (commands.Undo, commands.Redo)) for c in _script)
+            document = Document.from_image(image, history=needs_history)
+        for command in _script:
+            document.apply(command)
+        saving.SaveJob(document.layers, target, _options["format"],
+                       saving.encoder_options(_options["format"], _options["compress_level"],
+                                              _options["optimize"], _options["quality"])).run()
+        error = None
+    except Exception as exc:
+        # A script command that does not fit this image fails the file, not the run.
+        target, error = None, f"{type(exc).__name__}: {exc}"
+    return path, target, (time.perf_counter() - start) * 1000, peak_rss_kb(), error
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply a drawing script to every image in a directory.")
+    parser.add_argument("script", help="JSON lines file of commands, as written by paint.commands.dump")
+    parser.add_argument("input_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--format", choices=sorted(set(saving.FORMATS.values())), default="PNG")
+    parser.add_argument("--quality", type=int, default=90)
+    parser.add_argument("--compress-level", type=int, default=6)
+    parser.add_argument("--optimize", action="store_true")
+    parser.add_argument("--max-memory", type=int, default=0, metavar="MB",
+                        help="address space limit per worker (0 = none)")
+    parser.add_argument("--files-per-worker", type=int, default=50,
+                        help="restart a worker after this many files to return its memory")
+    args = parser.parse_args(argv)
+    # Results would overwrite their inputs, and the lazy listing could pick them up again.
+    if os.path.isdir(args.output_dir) and os.path.samefile(args.input_dir, args.output_dir):
+        parser.error("output_dir must differ from input_dir")
+
+    with open(args.script) as fp:
+        script = commands.load(fp)
+    os.makedirs(args.output_dir, exist_ok=True)
+    options = {"format": args.format, "quality": args.quality,
+               "compress_level": args.compress_level, "optimize": args.optimize}
+
+    done = failed = 0
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.workers, start_worker, (script, options, args.max_memory),
+                              maxtasksperchild=args.files_per_worker) as pool:
+        # Results are printed as they finish, in whatever order that is.
+        work = jobs(inputs(args.input_dir), args.output_dir, args.format)
+        for path, target, ms, rss, error in pool.imap_unordered(process, work):
+            name = os.path.basename(path)
+            if error is None:
+                done += 1
+                print(f"{name:<32}{ms:>10.1f} ms{(rss or 0) // 1024:>8} MB  -> {target}", flush=True)
+            else:
+                failed += 1
+                print(f"{name:<32}{ms:>10.1f} ms  GAGAL {error}", flush=True)
+    elapsed = time.perf_counter() - start
+    print(f"{done} file selesai, {failed} gagal, {elapsed:.2f} s dengan {args.workers} worker")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
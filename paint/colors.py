@@ -0,0 +1,55 @@
+from functools import lru_cache
+
+from PIL import ImageColor
+
+
+# Colours the pseudo-3D tools use for their shadows and side faces.
+PALETTE = ("black", "white", "gray", "darkgray")
+
+_tk_lookup = None
+
+
+def use_tk(root):
+    # Names only Tk knows (e.g. "SystemButtonFace") fall back to the interpreter.
+    global _tk_lookup
+    _tk_lookup = root.winfo_rgb
+    rgba.cache_clear()
+    preload()
+
+
+@lru_cache(maxsize=512)
+def rgba(color):
+    if isinstance(color, tuple):
+        return tuple(color) + (255,) * (4 - len(color))
+    try:
+        return ImageColor.getcolor(color, "RGBA")
+    except ValueError:
+        if _tk_lookup is None:
+            raise
+        r, g, b = _tk_lookup(color)
+        return (r // 256, g // 256, b // 256, 255)
+
+
+def rgb(color):
+    return rgba(color)[:3]
+
+
+def resolve(color, mode="RGB"):
+    if mode == "RGBA":
+        return rgba(color)
+    if mode == "L":
+        r, g, b = rgb(color)
+        return (r * 299 + g * 587 + b * 114) // 1000
+    return rgb(color)
+
+
+def preload(names=PALETTE):
+    for name in names:
+        rgba(name)
+
+
+def cache_info():
+    return rgba.cache_info()
+
+
+preload()
@@ -0,0 +1,161 @@
+import json
+from dataclasses import dataclass, fields
+
+
+SHAPE_TOOLS = ["line", "line_bresenham", "rectangle", "oval", "circle_midpoint",
+               "circle", "triangle", "rectangle3d", "circle3d", "triangle3d"]
+
+
+@dataclass(frozen=True)
+class Shape:
+    tool: str
+    x0: int
+    y0: int
+    x1: int
+    y1: int
+    color: str = "black"
+    width: int = 5
+
+
+@dataclass(frozen=True)
+class Stroke:
+    points: tuple
+    color: str = "black"
+    width: int = 5
+
+
+@dataclass(frozen=True)
+class Fill:
+    x: int
+    y: int
+    color: str = "black"
+    tolerance: int = 0
+    connectivity: int = 4
+
+
+@dataclass(frozen=True)
+class MoveSelection:
+    box: tuple
+    dx: int
+    dy: int
+
+
+@dataclass(frozen=True)
+class RotateSelection:
+    box: tuple
+
+
+@dataclass(frozen=True)
+class TransformSelection:
+    box: tuple
+    dx: int = 0
+    dy: int = 0
+    angle: float = 0.0
+    scale_x: float = 1.0
+    scale_y: float = 1.0
+
+
+@dataclass(frozen=True)
+class Rotate:
+    pass
+
+
+@dataclass(frozen=True)
+class Flip:
+    axis: str = "horizontal"
+
+
+@dataclass(frozen=True)
+class Clear:
+    pass
+
+
+@dataclass(frozen=True)
+class AddLayer:
+    name: str = ""
+
+
+@dataclass(frozen=True)
+class RemoveLayer:
+    index: int
+
+
+@dataclass(frozen=True)
+class SelectLayer:
+    index: int
+
+
+@dataclass(frozen=True)
+class MoveLayer:
+    index: int
+    to: int
+
+
+@dataclass(frozen=True)
+class LayerProperties:
+    index: int
+    visible: bool = None
+    opacity: float = None
+    blend: str = None
+
+
+@dataclass(frozen=True)
+class Undo:
+    pass
+
+
+@dataclass(frozen=True)
+class Redo:
+    pass
+
+
+COMMANDS = {
+    "shape": Shape,
+    "stroke": Stroke,
+    "fill": Fill,
+    "move_selection": MoveSelection,
+    "rotate_selection": RotateSelection,
+    "transform_selection": TransformSelection,
+    "rotate": Rotate,
+    "flip": Flip,
+    "clear": Clear,
+    "add_layer": AddLayer,
+    "remove_layer": RemoveLayer,
+    "select_layer": SelectLayer,
+    "move_layer": MoveLayer,
+    "layer_properties": LayerProperties,
+    "undo": Undo,
+    "redo": Redo,
+}
+KINDS = {cls: kind for kind, cls in COMMANDS.items()}
+LAYER_COMMANDS = (AddLayer, RemoveLayer, SelectLayer, MoveLayer, LayerProperties)
+
+
+def kind(command):
+    return KINDS[type(command)]
+
+
+def to_dict(command):
+    # Shallow on purpose: fields are plain values or tuples, and asdict's deep copy of
+    # long stroke point lists costs more than the JSON encoding itself.
+    return {"kind": kind(command), **{field.name: getattr(command, field.name) for field in fields(command)}}
+
+
+def from_dict(data):
+    data = dict(data)
+    cls = COMMANDS[data.pop("kind")]
+    # JSON turns tuples into lists; commands stay hashable by converting them back.
+    for field in fields(cls):
+        value = data.get(field.name)
+        if isinstance(value, list):
+            data[field.name] = tuple(tuple(v) if isinstance(v, list) else v for v in value)
+    return cls(**data)
+
+
+def dump(commands, fp):
+    for command in commands:
+        fp.write(json.dumps(to_dict(command)) + "\n")
+
+
+def load(fp):
+    return [from_dict(json.loads(line)) for line in fp if line.strip()]
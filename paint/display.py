@@ -0,0 +1,178 @@
+from PIL import ImageTk
+
+from paint.profiling import timed
+from paint.pyramid import Pyramid, level_size
+
+
+class Display:
+    # ImageTk.PhotoImage.paste() always uploads the whole photo, so the canvas is shown as
+    # a grid of tile photos and only dirty tiles are re-pasted. Only tiles inside the
+    # viewport have a photo, and below 100% (level > 0) they come from a Pyramid.
+    def __init__(self, canvas, tile_size=256):
+        self.canvas = canvas
+        self.tile_size = tile_size
+        self.image = None
+        self.image_size = None
+        self.pyramid = None
+        self.level = 0
+        self.tiles = {}
+        self.dirty = set()
+        self.discard_tags = set()
+        self.scheduled = None
+        self.pushed_tiles = 0
+        self.pushed_bytes = 0
+        self.rebuilds = 0
+        self.rebuilt_bytes = 0
+
+    @property
+    def size(self):
+        return level_size(self.image_size, self.level)
+
+    @property
+    def scale(self):
+        return 1 << self.level
+
+    def update(self, image, box=None):
+        if image is not self.image:
+            self.show(image, level=0)
+            return
+        if image.size != self.image_size:
+            self.image_size = image.size
+            self.pyramid.mark_dirty()
+            self._rebuild()
+            return
+        self.pyramid.mark_dirty(box)
+        self.mark_dirty(box if box is not None else (0, 0) + image.size)
+
+    def show(self, image, proxy=None, factor=1, level=None):
+        # A new canvas, optionally with a reduced-scale proxy for the zoomed-out levels.
+        self.image = image
+        self.image_size = image.size
+        self.pyramid = Pyramid(image, self.tile_size)
+        if proxy is not None:
+            self.pyramid.seed(proxy, factor)
+        self.level = self.fit_level() if level is None else level
+        self._rebuild()
+        self.canvas.xview_moveto(0)
+        self.canvas.yview_moveto(0)
+
+    def fit_level(self):
+        width, height = self.viewport_size()
+        level = 0
+        while level < self.pyramid.max_level:
+            w, h = level_size(self.image_size, level)
+            if w <= width and h <= height:
+                break
+            level += 1
+        return level
+
+    def set_level(self, level, anchor=None):
+        # Zooms keeping the canvas point under anchor (widget coordinates) in place.
+        level = max(0, min(level, self.pyramid.max_level))
+        if level == self.level:
+            return
+        width, height = self.viewport_size()
+        ax, ay = anchor if anchor is not None else (width // 2, height // 2)
+        x, y = self.to_canvas(ax, ay)
+        self.level = level
+        self._rebuild()
+        w, h = self.size
+        self.canvas.xview_moveto(max(0, x / self.scale - ax) / w)
+        self.canvas.yview_moveto(max(0, y / self.scale - ay) / h)
+        self.scrolled()
+
+    def to_canvas(self, x, y):
+        # Widget coordinates to full-resolution canvas coordinates.
+        return (int(self.canvas.canvasx(x)) * self.scale, int(self.canvas.canvasy(y)) * self.scale)
+
+    def viewport_size(self):
+        return (max(self.canvas.winfo_width(), int(self.canvas.cget("width"))),
+                max(self.canvas.winfo_height(), int(self.canvas.cget("height"))))
+
+    def viewport(self):
+        width, height = self.viewport_size()
+        x0, y0 = int(self.canvas.canvasx(0)), int(self.canvas.canvasy(0))
+        return (x0, y0, x0 + width, y0 + height)
+
+    def scrolled(self):
+        # Tiles scrolled into view get a photo; the ones that left the view give theirs up.
+        if self.image is None:
+            return
+        w, h = self.size
+        x0, y0, x1, y1 = self.viewport()
+        x0, y0, x1, y1 = max(0, x0), max(0, y0), min(w, x1), min(h, y1)
+        t = self.tile_size
+        visible = set()
+        if x0 < x1 and y0 < y1:
+            visible = {(tx, ty) for ty in range(y0 // t, (y1 - 1) // t + 1)
+                       for tx in range(x0 // t, (x1 - 1) // t + 1)}
+        for key in set(self.tiles) - visible:
+            _, item = self.tiles.pop(key)
+            self.canvas.delete(item)
+            self.dirty.discard(key)
+        for key in visible - set(self.tiles):
+            box = self._tile_box(key, self.size)
+            photo = ImageTk.PhotoImage("RGB", (box[2] - box[0], box[3] - box[1]))
+            item = self.canvas.create_image(box[0], box[1], anchor="nw", image=photo,
+                                            tags="display")
+            self.tiles[key] = (photo, item)
+            self.dirty.add(key)
+            self.rebuilt_bytes += (box[2] - box[0]) * (box[3] - box[1]) * 3
+        self.canvas.tag_lower("display")
+        if self.dirty:
+            self._schedule()
+
+    def mark_dirty(self, box):
+        if self.image is None:
+            return
+        t, s = self.tile_size, self.scale
+        w, h = self.size
+        x0, y0 = max(0, int(box[0]) // s), max(0, int(box[1]) // s)
+        x1, y1 = min(w, -(-int(box[2]) // s)), min(h, -(-int(box[3]) // s))
+        if x0 >= x1 or y0 >= y1:
+            return
+        for ty in range(y0 // t, (y1 - 1) // t + 1):
+            for tx in range(x0 // t, (x1 - 1) // t + 1):
+                # Tiles off screen are painted when they scroll into view.
+                if (tx, ty) in self.tiles:
+                    self.dirty.add((tx, ty))
+        self._schedule()
+
+    def discard(self, tag):
+        # Items with this tag are removed only once the tiles under them are current.
+        self.discard_tags.add(tag)
+        self._schedule()
+
+    @timed("frame")
+    def flush(self):
+        if self.scheduled is not None:
+            self.canvas.after_cancel(self.scheduled)
+            self.scheduled = None
+        for key in sorted(self.dirty):
+            photo, _ = self.tiles[key]
+            box = self._tile_box(key, self.size)
+            photo.paste(self.pyramid.crop(self.level, box))
+            self.pushed_tiles += 1
+            self.pushed_bytes += (box[2] - box[0]) * (box[3] - box[1]) * 3
+        self.dirty.clear()
+        for tag in self.discard_tags:
+            self.canvas.delete(tag)
+        self.discard_tags.clear()
+
+    def _schedule(self):
+        if self.scheduled is None:
+            self.scheduled = self.canvas.after_idle(self.flush)
+
+    def _rebuild(self):
+        self.canvas.delete("display")
+        self.tiles = {}
+        self.dirty.clear()
+        self.rebuilds += 1
+        w, h = self.size
+        self.canvas.config(scrollregion=(0, 0, w, h))
+        self.scrolled()
+
+    def _tile_box(self, key, size):
+        t = self.tile_size
+        x0, y0 = key[0] * t, key[1] * t
+        return (x0, y0, min(x0 + t, size[0]), min(y0 + t, size[1]))
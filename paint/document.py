@@ -0,0 +1,324 @@
+from PIL import Image
+
+from paint import colors, commands, fill, shapes
+from paint.layers import LayerStack
+from paint.profiling import timed
+from paint.selection import FloatingSelection
+from paint.stroke import Stroke
+from paint.tiles import TileStore, union
+
+
+def _ignore(box):
+    pass
+
+
+def flatten(image, background="white", mode="RGB"):
+    if "A" in image.getbands() or "transparency" in image.info:
+        # Transparent pixels show the background, as they would when viewed.
+        image = Image.alpha_composite(Image.new("RGBA", image.size, colors.rgba(background)),
+                                      image.convert("RGBA"))
+    return image.convert(mode)
+
+
+class Renderer:
+    # Applies commands to a tile store. Knows nothing about Tk or undo.
+    def __init__(self, sprites=None):
+        self.sprites = sprites or shapes.SpriteCache()
+
+    def apply(self, image, command, before=_ignore):
+        if isinstance(command, commands.Shape):
+            return image, self.shape(image, command, before)
+        if isinstance(command, commands.Stroke):
+            return image, self.stroke(image, command, before)
+        if isinstance(command, commands.Fill):
+            return image, self.fill(image, command, before)
+        if isinstance(command, commands.MoveSelection):
+            return image, self.move_selection(image, command, before)
+        if isinstance(command, commands.RotateSelection):
+            return image, self.rotate_selection(image, command, before)
+        if isinstance(command, commands.TransformSelection):
+            return image, self.transform_selection(image, command, before)
+        if isinstance(command, commands.Rotate):
+            return self.rotate(image)
+        if isinstance(command, commands.Flip):
+            return image.transpose(self.transpose_method(command, image)), (0, 0) + image.size
+        if isinstance(command, commands.Clear):
+            return TileStore(image.size, image.mode, image.background, image.tile_size), (0, 0) + image.size
+        raise ValueError(f"Renderer cannot apply {command!r}")
+
+    shape_bounds = staticmethod(shapes.bounds)
+
+    def shape(self, image, command, before=_ignore):
+        tool, color, width = command.tool, command.color, command.width
+        x0, y0 = command.x0, command.y0
+        dx, dy = command.x1 - x0, command.y1 - y0
+        bounds = shapes.bounds(tool, x0, y0, command.x1, command.y1, width)
+        before(bounds)
+        primitives = shapes.geometry(tool, dx, dy, width)
+        sprite = None
+        if shapes.rasterized(primitives):
+            # Shapes are translation invariant, so a repeat of the same drag, colour and pen
+            # is pasted from the sprite cache instead of being rasterized again.
+            key = (tool, dx, dy, color, width, image.mode)
+            sprite = self.sprites.get(key)
+            if sprite is None and self.sprites.wanted(key, (bounds[2] - bounds[0], bounds[3] - bounds[1])):
+                sprite = shapes.render(tool, dx, dy, color, width, image.mode)
+                self.sprites.put(key, sprite)
+        with image.edit(bounds) as draw:
+            if sprite is not None:
+                draw.paste(sprite[0], bounds[:2], sprite[1])
+            else:
+                ox, oy = draw.origin
+                shapes.draw(draw.image, primitives, x0 - ox, y0 - oy, shapes.palette(color, image.mode))
+        return bounds
+
+    def stroke(self, image, command, before=_ignore):
+        points = list(command.points)
+        stroke = Stroke(points[0][0], points[0][1], colors.resolve(command.color, image.mode), command.width)
+        for x, y in points[1:]:
+            stroke.add(x, y)
+        box = stroke.pending_box()
+        if box is None:
+            return None
+        before(box)
+        stroke.rasterize(image)
+        return stroke.box
+
+    def fill(self, image, command, before=_ignore):
+        x, y = command.x, command.y
+        if not (0 <= x < image.width and 0 <= y < image.height):
+            return None
+        # The fill needs the whole connected area, so it runs on a flat copy and writes back its box.
+        region = image.crop((0, 0) + image.size)
+        box = fill.flood_fill(region, x, y, colors.resolve(command.color, image.mode),
+                              tolerance=command.tolerance, connectivity=command.connectivity,
+                              before=before)
+        if box:
+            image.paste(region.crop(box), box[:2])
+        return box
+
+    def move_selection(self, image, command, before=_ignore):
+        x_old0, y_old0, x_old1, y_old1 = command.box
+        selection = image.crop(command.box)
+        x0, y0 = x_old0 + command.dx, y_old0 + command.dy
+        w, h = selection.size
+        box = union((x_old0, y_old0, x_old1 + 1, y_old1 + 1), (x0, y0, x0 + w, y0 + h))
+        before(box)
+        with image.edit(box) as draw:
+            draw.rectangle([x_old0, y_old0, x_old1, y_old1], fill=image.background)
+            draw.paste(selection, (x0, y0))
+        return box
+
+    def rotate_selection(self, image, command, before=_ignore):
+        x_old0, y_old0, x_old1, y_old1 = command.box
+        rotated = image.crop(command.box).rotate(-90, expand=True)
+        w, h = rotated.size
+        box = union((x_old0, y_old0, x_old1 + 1, y_old1 + 1), (x_old0, y_old0, x_old0 + w, y_old0 + h))
+        before(box)
+        with image.edit(box) as draw:
+            draw.rectangle([x_old0, y_old0, x_old1, y_old1], fill=image.background)
+            draw.paste(rotated, (x_old0, y_old0))
+        return box
+
+    def transform_selection(self, image, command, before=_ignore):
+        selection = FloatingSelection.from_command(image, command)
+        # The source pixels are read before the region is cleared.
+        pixels, (x, y) = selection.render(Image.BICUBIC)
+        x, y = x + command.dx, y + command.dy
+        x0, y0, x1, y1 = selection.box
+        box = union((x0, y0, x1, y1), (x, y, x + pixels.width, y + pixels.height))
+        before(box)
+        with image.edit(box) as draw:
+            if x1 > x0 and y1 > y0:
+                draw.rectangle([x0, y0, x1 - 1, y1 - 1], fill=image.background)
+            draw.composite(pixels, (x, y))
+        return box
+
+    @staticmethod
+    def transpose_method(command, image):
+        # Whole-canvas commands that are a plain transpose, which can run tile-parallel.
+        if isinstance(command, commands.Flip):
+            return Image.FLIP_LEFT_RIGHT if command.axis == "horizontal" else Image.FLIP_TOP_BOTTOM
+        if isinstance(command, commands.Rotate) and image.width == image.height:
+            return Image.ROTATE_270
+        return None
+
+    def rotate(self, image):
+        if image.width == image.height:
+            return image.transpose(Image.ROTATE_270), (0, 0) + image.size
+        rotated = image.to_image().rotate(-90, expand=True)
+        new_canvas = Image.new(image.mode, image.size, image.fill_value)
+        rotated_width, rotated_height = rotated.size
+        center_x = (image.width - rotated_width) // 2
+        center_y = (image.height - rotated_height) // 2
+        new_canvas.paste(rotated, (center_x, center_y))
+        return TileStore.from_image(new_canvas, background=image.background,
+                                    tile_size=image.tile_size), (0, 0) + image.size
+
+
+class Document:
+    # A layer stack plus per-layer undo; every edit arrives as a command from paint.commands
+    # and lands on the active layer.
+    def __init__(self, size, background="white", history=True, renderer=None, tile_size=256):
+        self.layers = LayerStack(size, background, tile_size, history)
+        self.renderer = renderer or Renderer()
+        self.log = []
+        self.journal = None
+        self.stroke = None
+        self.stroke_points = []
+        self.stroke_color = None
+
+    @classmethod
+    def from_image(cls, image, background="white", history=True, renderer=None, tile_size=256):
+        # The image becomes the bottom layer; all-background tiles stay unallocated.
+        document = cls(image.size, background, history, renderer, tile_size)
+        document.image.paste(flatten(image, background, document.image.mode), (0, 0))
+        document.layers.mark_dirty()
+        return document
+
+    @property
+    def size(self):
+        return self.layers.size
+
+    @property
+    def image(self):
+        return self.layers.current.image
+
+    @image.setter
+    def image(self, image):
+        if image is not self.layers.current.image:
+            self.layers.replace(self.layers.current, image)
+
+    @property
+    def history(self):
+        return self.layers.current.history
+
+    @timed("document.apply")
+    def apply(self, command, result=None):
+        # result is the finished layer for a whole-canvas command computed elsewhere,
+        # e.g. by a TileExecutor; it must come from the current active layer.
+        box = self._apply(command, result)
+        # Logged only once applied, so a command that raised is not replayed.
+        self.log.append(command)
+        if box is not None and not isinstance(command, commands.LAYER_COMMANDS):
+            self.layers.mark_dirty(box)
+        if self.journal is not None:
+            self.journal.append(command, box is not None)
+        return box
+
+    def _apply(self, command, result=None):
+        if isinstance(command, commands.LAYER_COMMANDS):
+            return self.apply_layer(command)
+        if isinstance(command, commands.Undo):
+            return self.undo(result)
+        if isinstance(command, commands.Redo):
+            return self.redo(result)
+
+        history = self.history
+        if history is None:
+            return self._render(command, result)
+        if isinstance(command, commands.Flip):
+            history.record_transform("flip_h" if command.axis == "horizontal" else "flip_v")
+        elif isinstance(command, commands.Rotate) and self.image.width == self.image.height:
+            # On a square canvas the rotation is lossless and can be undone by rotating back.
+            history.record_transform("rotate_cw")
+        elif isinstance(command, (commands.Rotate, commands.Clear)):
+            history.record_replace(self.image, commands.kind(command))
+        else:
+            history.begin(self.image, commands.kind(command))
+            self.image, box = self.renderer.apply(self.image, command, before=history.touch)
+            history.commit()
+            return box
+        return self._render(command, result)
+
+    def _render(self, command, result):
+        if result is not None:
+            self.image = result
+            return (0, 0) + result.size
+        self.image, box = self.renderer.apply(self.image, command)
+        return box
+
+    def apply_layer(self, command):
+        layers = self.layers
+        if isinstance(command, commands.SelectLayer):
+            layers.select(command.index)
+            return None
+        if isinstance(command, commands.AddLayer):
+            layers.add(command.name or None)
+            return None
+        if isinstance(command, commands.RemoveLayer):
+            layers.remove(command.index)
+        elif isinstance(command, commands.MoveLayer):
+            layers.move(command.index, command.to)
+        else:
+            layers.configure(command.index, command.visible, command.opacity, command.blend)
+        # The stack has already marked the tiles the layer covers; the box is for the display.
+        return (0, 0) + self.size
+
+    def transpose_method(self, command):
+        # The transpose an Undo or Redo would perform on the active layer, or None.
+        if not self.history or not isinstance(command, (commands.Undo, commands.Redo)):
+            return None
+        return self.history.next_transpose(undo=isinstance(command, commands.Undo))
+
+    def undo(self, transposed=None):
+        result = self.history.undo(self.image, transposed) if self.history else None
+        if not result:
+            return None
+        self.image, box = result
+        return box
+
+    def redo(self, transposed=None):
+        result = self.history.redo(self.image, transposed) if self.history else None
+        if not result:
+            return None
+        self.image, box = result
+        return box
+
+    # Interactive strokes are rasterized as they are drawn and logged once finished.
+    def begin_stroke(self, x, y, color, width):
+        self.stroke = Stroke(x, y, colors.resolve(color, self.image.mode), width)
+        self.stroke_points = [(x, y)]
+        self.stroke_color = color
+        if self.history:
+            self.history.begin(self.image, "stroke")
+
+    def extend_stroke(self, x, y):
+        self.stroke.add(x, y)
+        self.stroke_points.append((x, y))
+
+    def flush_stroke(self):
+        box = self.stroke.pending_box() if self.stroke else None
+        if box is None:
+            return None
+        if self.history:
+            self.history.touch(box)
+        box = self.stroke.rasterize(self.image)
+        if box is not None:
+            self.layers.mark_dirty(box)
+        return box
+
+    def end_stroke(self):
+        if self.stroke is None:
+            return None
+        self.flush_stroke()
+        if self.history:
+            self.history.commit()
+        box = self.stroke.box
+        if box is not None:
+            self.log.append(commands.Stroke(tuple(self.stroke_points), self.stroke_color,
+                                            self.stroke.width))
+            if self.journal is not None:
+                self.journal.append(self.log[-1])
+        self.stroke = None
+        self.stroke_points = []
+        return box
+
+
+def replay(command_list, size=(650, 650), background="white"):
+    # History is only kept when the stream actually needs it.
+    needs_history = any(isinstance(c, (commands.Undo, commands.Redo)) for c in command_list)
+    document = Document(size, background, history=needs_history)
+    for command in command_list:
+        document.apply(command)
+    return document
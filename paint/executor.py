@@ -0,0 +1,226 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+from PIL import Image, ImageFilter
+
+from paint.tiles import TileStore
+
+
+FILTERS = {
+    "blur": ImageFilter.BLUR,
+    "smooth": ImageFilter.SMOOTH,
+    "sharpen": ImageFilter.SHARPEN,
+    "edge": ImageFilter.EDGE_ENHANCE,
+    "emboss": ImageFilter.EMBOSS,
+}
+
+# Every filter above reads at most a 5x5 neighbourhood, so tiles are cut with this much overlap.
+HALO = 2
+
+SWAPS_AXES = (Image.ROTATE_90, Image.ROTATE_270, Image.TRANSPOSE, Image.TRANSVERSE)
+
+
+def output_size(size, op):
+    if op[0] == "transpose" and op[1] in SWAPS_AXES:
+        return (size[1], size[0])
+    return size
+
+
+def source_box(store, op, box):
+    # The part of the source a destination tile depends on.
+    if op[0] == "transpose":
+        return store._source_box(op[1], box)
+    x0, y0, x1, y1 = box
+    return store.clip((x0 - HALO, y0 - HALO, x1 + HALO, y1 + HALO))
+
+
+def run_op(op, region, box, source):
+    # Turns the cropped source region into the destination region box.
+    if op[0] == "transpose":
+        return region.transpose(op[1])
+    out = region.filter(FILTERS[op[1]])
+    return out.crop((box[0] - source[0], box[1] - source[1],
+                     box[2] - source[0], box[3] - source[1]))
+
+
+def _process_tile(op, mode, size, tile_size, source_name, out_name, slot, box, source):
+    # Runs in a worker process: reads the canvas from one shared block and writes the
+    # finished tile into its slot of another, so no pixels go through pickle.
+    source_shm = shared_memory.SharedMemory(source_name)
+    out_shm = shared_memory.SharedMemory(out_name)
+    try:
+        # Only the rows the tile needs are unpacked, then cut down to its columns.
+        stride = size[0] * Image.getmodebands(mode)
+        rows = bytes(source_shm.buf[source[1] * stride:source[3] * stride])
+        band = Image.frombytes(mode, (size[0], source[3] - source[1]), rows)
+        region = band.crop((source[0], 0, source[2], band.height))
+        tile = Image.new(mode, (tile_size, tile_size))
+        tile.paste(run_op(op, region, box, source), (0, 0))
+        data = tile.tobytes()
+        out_shm.buf[slot * len(data):(slot + 1) * len(data)] = data
+    finally:
+        source_shm.close()
+        out_shm.close()
+
+
+class TileJob:
+    def __init__(self, source, op, tile_size):
+        self.source = source
+        self.op = op
+        size = output_size(source.size, op)
+        self.result = TileStore(size, source.mode, source.background, tile_size)
+        self.boxes = []
+        for key in self.result.keys((0, 0) + size):
+            box = self.result._intersect((0, 0) + size, key)
+            # Destination tiles whose source is untouched background stay unallocated.
+            if op[0] == "transpose" and not any(source.is_allocated(k)
+                                               for k in source.keys(source_box(source, op, box))):
+                continue
+            self.boxes.append((key, box))
+        self.futures = []
+        self.done = 0
+        self.cancelled = False
+        self.error = None
+        self.callbacks = []
+        self.progress_callbacks = []
+        self.reported = -1
+        self.shared = []
+        self.lock = threading.Lock()
+
+    @property
+    def total(self):
+        return len(self.boxes)
+
+    def progress(self):
+        return self.done / self.total if self.total else 1.0
+
+    def finished(self):
+        return all(future.done() for future in self.futures)
+
+    def cancel(self):
+        self.cancelled = True
+        for future in self.futures:
+            future.cancel()
+
+    def run_tile(self, key, box):
+        # Thread workers share the snapshot; each writes a distinct destination tile.
+        if self.cancelled:
+            return
+        source = source_box(self.source, self.op, box)
+        region = run_op(self.op, self.source.crop(source), box, source)
+        self.result.paste(region, box[:2])
+        with self.lock:
+            self.done += 1
+
+    def tile_done(self, future):
+        if not future.cancelled() and future.exception() is None:
+            with self.lock:
+                self.done += 1
+
+
+class TileExecutor:
+    # Splits whole-canvas transforms and filters into destination tiles and runs them on a
+    # pool. Thread workers read a snapshot directly (Pillow releases the GIL in transpose
+    # and filter); process workers go through shared memory. Callbacks only run from poll().
+    def __init__(self, workers=None, processes=False):
+        self.workers = workers or os.cpu_count() or 1
+        self.processes = processes
+        if processes:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tiles")
+        self.jobs = []
+
+    def transpose(self, image, method, on_done=None, on_progress=None):
+        return self.submit(image, ("transpose", method), on_done, on_progress)
+
+    def filter(self, image, name, on_done=None, on_progress=None):
+        if name not in FILTERS:
+            raise ValueError(f"Unknown filter {name!r}")
+        return self.submit(image, ("filter", name), on_done, on_progress)
+
+    def submit(self, image, op, on_done=None, on_progress=None):
+        job = TileJob(image.snapshot(), op, image.tile_size)
+        if on_done is not None:
+            job.callbacks.append(on_done)
+        if on_progress is not None:
+            job.progress_callbacks.append(on_progress)
+        if self.processes:
+            self._submit_shared(job)
+        else:
+            job.futures = [self.pool.submit(job.run_tile, key, box) for key, box in job.boxes]
+        self.jobs.append(job)
+        return job
+
+    def run(self, image, op):
+        job = self.submit(image, op)
+        self.wait(job)
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def poll(self):
+        for job in list(self.jobs):
+            if job.done != job.reported:
+                job.reported = job.done
+                for callback in job.progress_callbacks:
+                    callback(job)
+            if not job.finished():
+                continue
+            self.jobs.remove(job)
+            self._finish(job)
+            for callback in job.callbacks:
+                callback(job)
+        return self.busy()
+
+    def busy(self):
+        return bool(self.jobs)
+
+    def wait(self, job=None):
+        while job in self.jobs if job is not None else self.busy():
+            for future in list((job or self.jobs[0]).futures):
+                if not future.cancelled():
+                    future.exception()
+            self.poll()
+
+    def shutdown(self):
+        for job in self.jobs:
+            job.cancel()
+        self.wait()
+        self.pool.shutdown()
+
+    def _submit_shared(self, job):
+        source = job.source.to_image()
+        data = source.tobytes()
+        t = job.result.tile_size
+        slot_size = t * t * len(source.getbands())
+        source_shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+        source_shm.buf[:len(data)] = data
+        del data
+        out_shm = shared_memory.SharedMemory(create=True, size=max(1, slot_size * job.total))
+        job.shared = [source_shm, out_shm]
+        for slot, (key, box) in enumerate(job.boxes):
+            future = self.pool.submit(_process_tile, job.op, source.mode, source.size, t,
+                                      source_shm.name, out_shm.name, slot, box,
+                                      source_box(job.source, job.op, box))
+            future.add_done_callback(job.tile_done)
+            job.futures.append(future)
+
+    def _finish(self, job):
+        errors = [future.exception() for future in job.futures if not future.cancelled()]
+        job.error = next((error for error in errors if error is not None), None)
+        if job.shared:
+            source_shm, out_shm = job.shared
+            if job.error is None and not job.cancelled:
+                t = job.result.tile_size
+                slot_size = t * t * Image.getmodebands(job.result.mode)
+                for slot, (key, box) in enumerate(job.boxes):
+                    data = bytes(out_shm.buf[slot * slot_size:(slot + 1) * slot_size])
+                    tile = Image.frombytes(job.result.mode, (t, t), data)
+                    job.result.paste(tile.crop((0, 0, box[2] - box[0], box[3] - box[1])), box[:2])
+            for shm in job.shared:
+                shm.close()
+                shm.unlink()
+            job.shared = []
@@ -0,0 +1,150 @@
+from PIL import Image, ImageChops
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def match_mask(image, x, y, tolerance):
+    # 255 where every band is within `tolerance` of the seed pixel, else 0.
+    target = image.getpixel((x, y))
+    diff = ImageChops.difference(image, Image.new(image.mode, image.size, target))
+    bands = diff.split()
+    mask = bands[0]
+    for band in bands[1:]:
+        mask = ImageChops.lighter(mask, band)
+    return mask.point(lambda v: 255 if v <= tolerance else 0)
+
+
+def scanline_region(image, x, y, tolerance=0, connectivity=4, max_spans=None):
+    w, h = image.size
+    buf = bytearray(match_mask(image, x, y, tolerance).tobytes())
+    zeros = bytes(w)
+    k = 1 if connectivity == 8 else 0
+    spans = []
+    stack = [(x, y)]
+    while stack:
+        sx, sy = stack.pop()
+        base = sy * w
+        if not buf[base + sx]:
+            continue
+        left = buf.rfind(0, base, base + sx)
+        left = left - base + 1 if left >= 0 else 0
+        right = buf.find(0, base + sx, base + w)
+        right = right - base if right >= 0 else w
+        buf[base + left:base + right] = zeros[:right - left]
+        spans.append((sy, left, right))
+        if max_spans is not None and len(spans) > max_spans:
+            return None
+
+        lo, hi = max(0, left - k), min(w, right + k)
+        for ny in (sy - 1, sy + 1):
+            if not 0 <= ny < h:
+                continue
+            nbase = ny * w
+            pos, end = nbase + lo, nbase + hi
+            while pos < end:
+                pos = buf.find(255, pos, end)
+                if pos < 0:
+                    break
+                stack.append((pos - nbase, ny))
+                pos = buf.find(0, pos, end)
+                if pos < 0:
+                    break
+
+    x0 = min(s[1] for s in spans)
+    x1 = max(s[2] for s in spans)
+    y0 = min(s[0] for s in spans)
+    y1 = max(s[0] for s in spans) + 1
+    bw = x1 - x0
+    mask = bytearray(bw * (y1 - y0))
+    for sy, left, right in spans:
+        start = (sy - y0) * bw + left - x0
+        mask[start:start + right - left] = b"\xff" * (right - left)
+    return (x0, y0, x1, y1), Image.frombytes("L", (bw, y1 - y0), bytes(mask))
+
+
+def numpy_region(image, x, y, tolerance=0, connectivity=4):
+    pixels = np.asarray(image)
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, None]
+    h, w = pixels.shape[:2]
+    target = pixels[y, x].astype(np.int16)
+    match = (np.abs(pixels.astype(np.int16) - target).max(axis=2) <= tolerance)
+
+    # Horizontal runs of matching pixels, in row-major order.
+    edges = np.diff(np.pad(match, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)[1]
+
+    # Runs on neighbouring rows that overlap (diagonally too for 8-connectivity) are linked.
+    k = 1 if connectivity == 8 else 0
+    stride = w + 4
+    start_keys = rows * stride + starts
+    end_keys = rows * stride + ends
+    below = np.nonzero(rows > 0)[0]
+    first = np.searchsorted(end_keys, (rows[below] - 1) * stride + starts[below] - k, side="right")
+    last = np.searchsorted(start_keys, (rows[below] - 1) * stride + ends[below] + k, side="left")
+    counts = np.maximum(last - first, 0)
+    a = np.repeat(below, counts)
+    b = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+    labels = np.arange(len(rows))
+    while True:
+        low = np.minimum(labels[a], labels[b])
+        updated = labels.copy()
+        np.minimum.at(updated, a, low)
+        np.minimum.at(updated, b, low)
+        while True:
+            jumped = updated[updated]
+            if np.array_equal(jumped, updated):
+                break
+            updated = jumped
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+
+    seed = np.nonzero((rows == y) & (starts <= x) & (ends > x))[0][0]
+    picked = labels == labels[seed]
+    rows, starts, ends = rows[picked], starts[picked], ends[picked]
+    x0, x1 = int(starts.min()), int(ends.max())
+    y0, y1 = int(rows.min()), int(rows.max()) + 1
+
+    steps = np.zeros((y1 - y0, x1 - x0 + 1), dtype=np.int32)
+    np.add.at(steps, (rows - y0, starts - x0), 1)
+    np.add.at(steps, (rows - y0, ends - x0), -1)
+    mask = (np.cumsum(steps, axis=1)[:, :-1] > 0).astype(np.uint8) * 255
+    return (x0, y0, x1, y1), Image.fromarray(mask)
+
+
+def auto_region(image, x, y, tolerance=0, connectivity=4):
+    # Scanline wins on large simple regions; fragmented ones fall through to NumPy.
+    region = scanline_region(image, x, y, tolerance, connectivity, max_spans=20000)
+    if region is None:
+        region = numpy_region(image, x, y, tolerance, connectivity)
+    return region
+
+
+BACKENDS = {"scanline": scanline_region}
+if np is not None:
+    BACKENDS["numpy"] = numpy_region
+    BACKENDS["auto"] = auto_region
+
+
+def default_backend():
+    return "auto" if "auto" in BACKENDS else "scanline"
+
+
+def flood_fill(image, x, y, color, tolerance=0, connectivity=4, backend=None, before=None):
+    # Returns the filled bounding box, or None when nothing changes.
+    if not (0 <= x < image.width and 0 <= y < image.height):
+        return None
+    if tolerance == 0 and image.getpixel((x, y)) == color:
+        return None
+    region = BACKENDS[backend or default_backend()]
+    box, mask = region(image, x, y, tolerance, connectivity)
+    if before is not None:
+        before(box)
+    image.paste(color, box, mask)
+    return box
@@ -0,0 +1,213 @@
+import zlib
+from PIL import Image
+
+from paint.profiling import timed
+
+
+# Full-canvas transforms that can be undone without storing any pixels.
+TRANSFORMS = {
+    "flip_h": (Image.FLIP_LEFT_RIGHT, Image.FLIP_LEFT_RIGHT),
+    "flip_v": (Image.FLIP_TOP_BOTTOM, Image.FLIP_TOP_BOTTOM),
+    "rotate_cw": (Image.ROTATE_270, Image.ROTATE_90),
+}
+
+
+def footprint(image):
+    if hasattr(image, "resident_bytes"):
+        return image.resident_bytes()
+    return image.width * image.height * Image.getmodebands(image.mode)
+
+
+class Edit:
+    def __init__(self, label):
+        self.label = label
+        self.patches = {}
+        self.transform = None
+        self.replaced = None
+        self.nbytes = 0
+        self.raw_bytes = 0
+
+    def is_empty(self):
+        return not self.patches and self.transform is None and self.replaced is None
+
+
+class History:
+    def __init__(self, budget=64 * 1024 * 1024, tile_size=64, compress=True, compress_level=1):
+        self.budget = budget
+        self.tile_size = tile_size
+        self.compress = compress
+        self.compress_level = compress_level
+        self.undo_stack = []
+        self.redo_stack = []
+        self.pending = None
+        self.image = None
+        self.bytes_used = 0
+        self.evicted = 0
+
+    def begin(self, image, label=""):
+        self.pending = Edit(label)
+        self.image = image
+
+    def touch(self, box):
+        if self.pending is None:
+            return
+        box = self._clip(box, self.image.size)
+        if box is None:
+            return
+        t = self.tile_size
+        x0, y0, x1, y1 = box
+        for ty in range(y0 // t, (y1 - 1) // t + 1):
+            for tx in range(x0 // t, (x1 - 1) // t + 1):
+                if (tx, ty) in self.pending.patches:
+                    continue
+                tile_box = self._clip((tx * t, ty * t, tx * t + t, ty * t + t), self.image.size)
+                self.pending.patches[(tx, ty)] = (tile_box, self._encode(self.image.crop(tile_box)))
+
+    def touch_all(self):
+        if self.pending is not None:
+            self.touch((0, 0) + self.image.size)
+
+    @timed("history.commit")
+    def commit(self):
+        edit, self.pending, self.image = self.pending, None, None
+        if edit is None or edit.is_empty():
+            return False
+        self._measure(edit)
+        self._push(edit)
+        return True
+
+    def cancel(self):
+        self.pending = None
+        self.image = None
+
+    def record_transform(self, name, label=""):
+        edit = Edit(label or name)
+        edit.transform = name
+        self._push(edit)
+
+    def record_replace(self, image, label=""):
+        # Operations that swap in a whole new canvas keep the old one instead of copying it.
+        edit = Edit(label)
+        edit.replaced = image
+        edit.nbytes = footprint(image)
+        self._push(edit)
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def next_transpose(self, undo=True):
+        # The transpose the next undo (or redo) performs, if it is one, so it can be computed
+        # elsewhere and handed back as result.
+        stack = self.undo_stack if undo else self.redo_stack
+        if not stack or stack[-1].transform is None:
+            return None
+        forward, inverse = TRANSFORMS[stack[-1].transform]
+        return inverse if undo else forward
+
+    def undo(self, image, result=None):
+        if not self.undo_stack:
+            return None
+        edit = self.undo_stack.pop()
+        result = self._apply(edit, image, undo=True, result=result)
+        self.redo_stack.append(edit)
+        self._enforce_budget()
+        return result
+
+    def redo(self, image, result=None):
+        if not self.redo_stack:
+            return None
+        edit = self.redo_stack.pop()
+        result = self._apply(edit, image, undo=False, result=result)
+        self.undo_stack.append(edit)
+        self._enforce_budget()
+        return result
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.pending = None
+        self.image = None
+        self.bytes_used = 0
+
+    def stats(self):
+        return {
+            "undo_entries": len(self.undo_stack),
+            "redo_entries": len(self.redo_stack),
+            "bytes_used": self.bytes_used,
+            "raw_bytes": sum(e.raw_bytes for e in self.undo_stack + self.redo_stack),
+            "budget": self.budget,
+            "evicted": self.evicted,
+        }
+
+    def _push(self, edit):
+        self.undo_stack.append(edit)
+        for old in self.redo_stack:
+            self.bytes_used -= old.nbytes
+        self.redo_stack.clear()
+        self.bytes_used += edit.nbytes
+        self._enforce_budget()
+
+    def _enforce_budget(self):
+        # The most recent edit is always kept so a single big edit stays undoable.
+        while self.bytes_used > self.budget and self.redo_stack:
+            self.bytes_used -= self.redo_stack.pop(0).nbytes
+            self.evicted += 1
+        while self.bytes_used > self.budget and len(self.undo_stack) > 1:
+            self.bytes_used -= self.undo_stack.pop(0).nbytes
+            self.evicted += 1
+
+    def _apply(self, edit, image, undo, result=None):
+        if edit.transform is not None:
+            if result is None:
+                forward, inverse = TRANSFORMS[edit.transform]
+                result = image.transpose(inverse if undo else forward)
+            return result, (0, 0) + image.size
+        if edit.replaced is not None:
+            previous, edit.replaced = edit.replaced, image
+            self.bytes_used += footprint(image) - edit.nbytes
+            edit.nbytes = edit.raw_bytes = footprint(image)
+            return previous, (0, 0) + previous.size
+
+        # Patches are swapped with the live pixels, so the same edit serves undo and redo.
+        self.bytes_used -= edit.nbytes
+        dirty = None
+        for key, (box, patch) in edit.patches.items():
+            current = self._encode(image.crop(box))
+            image.paste(self._decode(patch), box[:2])
+            edit.patches[key] = (box, current)
+            dirty = box if dirty is None else (min(dirty[0], box[0]), min(dirty[1], box[1]),
+                                               max(dirty[2], box[2]), max(dirty[3], box[3]))
+        self._measure(edit)
+        self.bytes_used += edit.nbytes
+        return image, dirty
+
+    def _measure(self, edit):
+        if edit.replaced is not None:
+            return
+        edit.nbytes = sum(len(patch[3]) for _, patch in edit.patches.values())
+        edit.raw_bytes = sum((box[2] - box[0]) * (box[3] - box[1]) * Image.getmodebands(patch[0])
+                             for box, patch in edit.patches.values())
+
+    def _encode(self, region):
+        data = region.tobytes()
+        if self.compress:
+            data = zlib.compress(data, self.compress_level)
+        return (region.mode, region.size, self.compress, data)
+
+    def _decode(self, patch):
+        mode, size, compressed, data = patch
+        if compressed:
+            data = zlib.decompress(data)
+        return Image.frombytes(mode, size, data)
+
+    @staticmethod
+    def _clip(box, size):
+        x0, y0, x1, y1 = box
+        x0, y0 = max(0, int(x0)), max(0, int(y0))
+        x1, y1 = min(size[0], int(x1)), min(size[1], int(y1))
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return (x0, y0, x1, y1)
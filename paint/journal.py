@@ -0,0 +1,348 @@
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+import weakref
+
+from PIL import Image
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+from paint import commands, opening
+from paint.document import Document
+
+
+SESSION = "session.json"
+
+# Locks on <session>.lock held for the life of the process; the OS drops them when the
+# process dies, so a crashed session is free to recover while a live one is not.
+_locks = {}
+
+
+def default_directory():
+    return os.environ.get("SIMPLE_PAINT_JOURNAL",
+                          os.path.join(os.path.expanduser("~"), ".simple-paint", "session"))
+
+
+def _lock(directory):
+    if directory in _locks:
+        return True
+    os.makedirs(os.path.dirname(os.path.abspath(directory)), exist_ok=True)
+    fp = open(directory + ".lock", "a+")
+    try:
+        if fcntl is not None:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fp.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        fp.close()
+        return False
+    _locks[directory] = fp
+    return True
+
+
+def _unlock(directory):
+    _locks.pop(directory).close()
+
+
+def claim(directory):
+    # One of directory, directory-2, ... that no other running instance is using, preferring
+    # one a crashed instance left a session in.
+    chosen = None
+    number = 1
+    while True:
+        candidate = directory if number == 1 else f"{directory}-{number}"
+        crashed = has_session(candidate)
+        if (chosen is None or crashed) and _lock(candidate):
+            if crashed:
+                if chosen is not None:
+                    _unlock(chosen)
+                return candidate
+            chosen = chosen or candidate
+        if number > 1 and not os.path.exists(candidate) and not os.path.exists(candidate + ".lock"):
+            return chosen
+        number += 1
+
+
+def has_session(directory):
+    return os.path.exists(os.path.join(directory, SESSION))
+
+
+def set_aside(directory):
+    # Moves a session that could not be recovered out of the way instead of deleting it.
+    target = directory + time.strftime(".failed-%Y%m%d-%H%M%S")
+    os.replace(directory, target)
+    return target
+
+
+def _fsync_dir(directory):
+    if hasattr(os, "O_DIRECTORY"):
+        fd = os.open(directory, os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _sequenced(directory, prefix, suffix=""):
+    found = []
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith(suffix):
+            number = name[len(prefix):len(name) - len(suffix)]
+            if number.isdigit():
+                found.append((int(number), os.path.join(directory, name)))
+    return sorted(found)
+
+
+def fingerprint(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def capture(document):
+    # Cheap enough for the UI thread: per-layer tile copies plus the stack settings.
+    layers = document.layers
+    meta = {"size": list(layers.size), "background": layers.background,
+            "tile_size": layers.tile_size, "active": layers.active, "layers": []}
+    stores = []
+    for layer in layers.layers:
+        meta["layers"].append({"name": layer.name, "visible": layer.visible,
+                               "opacity": layer.opacity, "blend": layer.blend})
+        stores.append(layer.image.snapshot())
+    return meta, stores
+
+
+def restore(directory, meta):
+    document = Document(tuple(meta["size"]), meta["background"], tile_size=meta["tile_size"])
+    layers = document.layers
+    for index, info in enumerate(meta["layers"]):
+        layer = layers.layers[0] if index == 0 else layers.add(info["name"], index)
+        layer.name = info["name"]
+        layer.visible, layer.opacity, layer.blend = info["visible"], info["opacity"], info["blend"]
+        with Image.open(os.path.join(directory, f"layer-{index}.png")) as image:
+            layer.image.paste(image.convert(layer.image.mode), (0, 0))
+    layers.select(meta["active"])
+    layers.mark_dirty()
+    return document
+
+
+def recover(directory):
+    # The newest complete snapshot plus every journaled command after it. A torn last line
+    # from a crash mid-write is ignored.
+    with open(os.path.join(directory, SESSION)) as fp:
+        session = json.load(fp)
+    base = 0
+    snapshots = _sequenced(directory, "snapshot-")
+    if snapshots:
+        base, path = snapshots[-1]
+        with open(os.path.join(path, "meta.json")) as fp:
+            document = restore(path, json.load(fp))
+    elif "opened" in session:
+        # Opened files are not copied into the journal; they are read again, but only if
+        # they are still the file the commands were drawn on.
+        if fingerprint(session["opened"]) != session.get("fingerprint"):
+            raise ValueError(f"{session['opened']} has changed or is missing since it was opened")
+        document = opening.open_document(session["opened"], background=session["background"],
+                                         tile_size=session["tile_size"])[0]
+    else:
+        document = Document(tuple(session["size"]), session["background"],
+                            tile_size=session["tile_size"])
+    replayed = 0
+    for _, path in _sequenced(directory, "journal-", ".jsonl"):
+        with open(path) as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if "resize" in record:
+                    size = tuple(max(a, b) for a, b in zip(document.size, record["resize"]))
+                    document.layers.resize(size)
+                elif record.pop("seq") > base:
+                    document.apply(commands.from_dict(record))
+                    replayed += 1
+    document.recovered = (base, replayed)
+    return document
+
+
+class Journal:
+    # Appends every committed command to journal-<seq>.jsonl and takes a PNG snapshot of all
+    # layers every snapshot_every commands, so recovery replays a bounded tail. The UI
+    # thread only queues lines and tile copies; a writer thread does the file work and
+    # fsyncs once per batch of whatever has queued up.
+    def __init__(self, directory, snapshot_every=250):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.document = None
+        self.opened = None
+        self.seq = 0
+        self.snapshot_seq = 0
+        self.written = 0
+        self.syncs = 0
+        self.error = None
+        self.queue = queue.Queue()
+        # Edits already in some layer's history when the last snapshot was taken.
+        self.settled = weakref.WeakSet()
+        self.fp = None
+        self.thread = None
+
+    def attach(self, document, opened=None):
+        # Starts a new session for document, dropping whatever the directory held. opened is
+        # the file the document was loaded from, if any.
+        if not _lock(self.directory):
+            raise RuntimeError(f"{self.directory} is in use by another instance")
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+        os.makedirs(self.directory)
+        layers = document.layers
+        session = {"size": list(layers.size), "background": layers.background,
+                   "tile_size": layers.tile_size}
+        if opened is not None:
+            session["opened"] = os.path.abspath(opened)
+            session["fingerprint"] = fingerprint(opened)
+        self.opened = session.get("opened")
+        with open(os.path.join(self.directory, SESSION), "w") as fp:
+            json.dump(session, fp)
+        self.document = document
+        document.journal = self
+        self._settle()
+        self.fp = open(os.path.join(self.directory, "journal-00000000.jsonl"), "a")
+        self.thread = threading.Thread(target=self._run, name="journal", daemon=True)
+        self.thread.start()
+        if opened is None and (len(layers.layers) > 1 or
+                               any(layer.image.allocated_tiles() for layer in layers.layers)):
+            self.snapshot()
+
+    def append(self, command, changed=True):
+        self.seq += 1
+        # Commands are immutable, so encoding can wait for the writer thread.
+        self.queue.put(("command", self.seq, command))
+        if self._outreaches(command, changed) or self.seq - self.snapshot_seq >= self.snapshot_every:
+            self.snapshot()
+
+    def _outreaches(self, command, changed):
+        # True when an Undo or Redo moved an edit from before the last snapshot. Recovered
+        # layers start with no history, so replaying it would do nothing; the state after
+        # it is snapshotted instead.
+        history = self.document.history
+        if not changed or history is None:
+            return False
+        if isinstance(command, commands.Undo):
+            return history.redo_stack[-1] in self.settled
+        if isinstance(command, commands.Redo):
+            return history.undo_stack[-1] in self.settled
+        return False
+
+    def _settle(self):
+        self.settled = weakref.WeakSet(edit for layer in self.document.layers.layers
+                                       if layer.history is not None
+                                       for edit in layer.history.undo_stack + layer.history.redo_stack)
+
+    def saved(self, path):
+        # Saving over the opened file changes what recovery would reopen, so the session
+        # stops depending on it.
+        if self.opened is not None and os.path.realpath(path) == os.path.realpath(self.opened):
+            self.opened = None
+            self.snapshot()
+
+    def resize(self, size):
+        self.queue.put(("line", json.dumps({"resize": list(size)})))
+
+    def snapshot(self):
+        self.snapshot_seq = self.seq
+        self._settle()
+        meta, stores = capture(self.document)
+        self.queue.put(("snapshot", self.seq, meta, stores))
+
+    def flush(self):
+        self.queue.join()
+
+    def close(self, discard=False):
+        # A clean exit leaves nothing to recover.
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        self.fp.close()
+        if self.document is not None:
+            self.document.journal = None
+        if discard:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _run(self):
+        while True:
+            items = [self.queue.get()]
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(items)
+            except Exception as error:
+                self.error = error
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+            if items[-1] is None:
+                return
+
+    def _write(self, items):
+        lines = []
+        for item in items:
+            if item is None:
+                break
+            if item[0] == "command":
+                lines.append(json.dumps({"seq": item[1], **commands.to_dict(item[2])}))
+                continue
+            if item[0] == "line":
+                lines.append(item[1])
+                continue
+            self._sync(lines)
+            lines = []
+            self._write_snapshot(*item[1:])
+        self._sync(lines)
+
+    def _sync(self, lines):
+        if not lines:
+            return
+        self.fp.write("\n".join(lines) + "\n")
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+        self.written += len(lines)
+        self.syncs += 1
+
+    def _write_snapshot(self, seq, meta, stores):
+        name = f"snapshot-{seq:08d}"
+        partial = os.path.join(self.directory, name + ".part")
+        os.makedirs(partial, exist_ok=True)
+        for index, store in enumerate(stores):
+            with open(os.path.join(partial, f"layer-{index}.png"), "wb") as fp:
+                store.to_image().save(fp, "PNG", compress_level=1)
+                fp.flush()
+                os.fsync(fp.fileno())
+        with open(os.path.join(partial, "meta.json"), "w") as fp:
+            json.dump(meta, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(partial, os.path.join(self.directory, name))
+        # Later lines go to a new segment; everything older than the snapshot can go.
+        self.fp.close()
+        self.fp = open(os.path.join(self.directory, f"journal-{seq:08d}.jsonl"), "a")
+        _fsync_dir(self.directory)
+        for number, path in _sequenced(self.directory, "snapshot-"):
+            if number < seq:
+                shutil.rmtree(path, ignore_errors=True)
+        for number, path in _sequenced(self.directory, "journal-", ".jsonl"):
+            if number < seq:
+                os.remove(path)
@@ -0,0 +1,202 @@
+from PIL import Image, ImageChops
+
+from paint import colors
+from paint.history import History
+from paint.tiles import TileStore
+
+
+TRANSPARENT = (0, 0, 0, 0)
+
+# Separable blend modes on the RGB bands; the result is then composited with the layer's alpha.
+BLENDS = {
+    "normal": None,
+    "multiply": ImageChops.multiply,
+    "screen": ImageChops.screen,
+    "overlay": ImageChops.overlay,
+    "darken": ImageChops.darker,
+    "lighten": ImageChops.lighter,
+    "difference": ImageChops.difference,
+    "add": ImageChops.add,
+}
+
+
+class Layer:
+    def __init__(self, name, size, background=TRANSPARENT, tile_size=256, history=True, mode="RGBA"):
+        self.name = name
+        self.image = TileStore(size, mode, background, tile_size)
+        self.history = History() if history else None
+        self.visible = True
+        self.opacity = 1.0
+        self.blend = "normal"
+
+
+class LayerStack:
+    # The flattened canvas, cached per tile. Only tiles marked dirty are recomposited,
+    # and only layers that have pixels allocated in a tile take part in it.
+    def __init__(self, size, background="white", tile_size=256, history=True):
+        self.width, self.height = size
+        self.mode = "RGB"
+        self.background = background
+        self.tile_size = tile_size
+        self.history = history
+        # The bottom layer is opaque, so it is kept as RGB like a flat canvas.
+        self.layers = [Layer("Background", size, background, tile_size, history, mode="RGB")]
+        self.active = 0
+        self.flat = TileStore(size, "RGB", background, tile_size)
+        self.dirty = set()
+        self.recomposited = 0
+
+    @property
+    def size(self):
+        return (self.width, self.height)
+
+    @property
+    def current(self):
+        return self.layers[self.active]
+
+    def add(self, name=None, index=None):
+        index = self.active + 1 if index is None else index
+        layer = Layer(name or f"Layer {len(self.layers)}", self.size, TRANSPARENT,
+                      self.tile_size, self.history)
+        self.layers.insert(index, layer)
+        self.active = index
+        return layer
+
+    def remove(self, index):
+        if len(self.layers) == 1:
+            return None
+        layer = self.layers.pop(index)
+        self.active = min(self.active, len(self.layers) - 1)
+        self.mark_layer(layer)
+        return layer
+
+    def move(self, index, to):
+        layer = self.layers.pop(index)
+        self.layers.insert(to, layer)
+        if self.active == index:
+            self.active = to
+        self.mark_layer(layer)
+
+    def select(self, index):
+        self.active = max(0, min(index, len(self.layers) - 1))
+
+    def configure(self, index, visible=None, opacity=None, blend=None):
+        layer = self.layers[index]
+        if visible is not None:
+            layer.visible = visible
+        if opacity is not None:
+            layer.opacity = max(0.0, min(1.0, opacity))
+        if blend is not None:
+            if blend not in BLENDS:
+                raise ValueError(f"Unknown blend mode {blend!r}")
+            layer.blend = blend
+        self.mark_layer(layer)
+
+    def replace(self, layer, image):
+        # Whole-layer operations hand back a new store; its old tiles and new tiles are both dirty.
+        self.mark_layer(layer)
+        layer.image = image
+        self.mark_layer(layer)
+
+    def mark_dirty(self, box=None):
+        box = self.flat.clip(box if box is not None else (0, 0) + self.size)
+        if box is not None:
+            self.dirty.update(self.flat.keys(box))
+
+    def mark_layer(self, layer):
+        # A layer only affects the tiles it has pixels in, or every tile when it is opaque.
+        if self.is_opaque(layer):
+            self.mark_dirty()
+        else:
+            self.dirty.update(layer.image.allocated_keys())
+
+    def resize(self, size):
+        for layer in self.layers:
+            layer.image.resize(size)
+        self.flat.resize(size)
+        self.width, self.height = size
+        self.mark_dirty()
+
+    @staticmethod
+    def is_opaque(layer):
+        return layer.image.mode == "RGB" or layer.image.fill_value[3] == 255
+
+    def passthrough(self):
+        # With nothing visible on top of a plain bottom layer, that layer is the composite.
+        bottom = self.layers[0]
+        if not bottom.visible or bottom.opacity < 1 or bottom.blend != "normal" or bottom.image.mode != "RGB":
+            return None
+        for layer in self.layers[1:]:
+            if layer.visible and layer.opacity > 0 and layer.image.allocated_tiles():
+                return None
+        return bottom.image
+
+    def composite(self, key):
+        t = self.tile_size
+        base = None
+        for layer in self.layers:
+            if not layer.visible or layer.opacity <= 0:
+                continue
+            tile = layer.image.tile(key)
+            if tile is None:
+                if not self.is_opaque(layer):
+                    continue
+                tile = Image.new(layer.image.mode, (t, t), layer.image.fill_value)
+            if base is None and layer.image.mode == "RGB" and layer.opacity == 1 and layer.blend == "normal":
+                base = tile
+                continue
+            if base is None:
+                base = Image.new("RGBA", (t, t), colors.rgba(self.background))
+            elif base.mode != "RGBA":
+                base = base.convert("RGBA")
+            if tile.mode != "RGBA":
+                tile = tile.convert("RGBA")
+            if layer.opacity < 1:
+                tile = tile.copy()
+                tile.putalpha(tile.getchannel("A").point(lambda a, o=layer.opacity: round(a * o)))
+            blend = BLENDS[layer.blend]
+            if blend is not None:
+                blended = blend(base.convert("RGB"), tile.convert("RGB")).convert("RGBA")
+                blended.putalpha(tile.getchannel("A"))
+                tile = blended
+            base = Image.alpha_composite(base, tile)
+        if base is None:
+            return Image.new("RGB", (t, t), colors.rgb(self.background))
+        return base if base.mode == "RGB" else base.convert("RGB")
+
+    def refresh(self, box=None):
+        box = self.flat.clip(box if box is not None else (0, 0) + self.size)
+        if box is None or not self.dirty:
+            return
+        for key in list(self.flat.keys(box)):
+            if key in self.dirty:
+                self.dirty.discard(key)
+                self.flat.tile(key, create=True).paste(self.composite(key), (0, 0))
+                self.recomposited += 1
+
+    def crop(self, box):
+        source = self.passthrough()
+        if source is not None:
+            return source.crop(box)
+        self.refresh(box)
+        return self.flat.crop(box)
+
+    def getpixel(self, xy):
+        source = self.passthrough()
+        if source is not None:
+            return source.getpixel(xy)
+        self.refresh((xy[0], xy[1], xy[0] + 1, xy[1] + 1))
+        return self.flat.getpixel(xy)
+
+    def to_image(self):
+        return self.crop((0, 0) + self.size)
+
+    def snapshot(self):
+        source = self.passthrough()
+        if source is not None:
+            return source.snapshot()
+        self.refresh()
+        return self.flat.snapshot()
+
+    def save(self, fp, format=None, **params):
+        self.to_image().save(fp, format, **params)
@@ -0,0 +1,50 @@
+import math
+import time
+
+from paint.profiling import profiler
+
+
+class MotionScheduler:
+    # Keeps only the newest pending motion event and handles it at most once per frame.
+    def __init__(self, widget, interval=16):
+        self.widget = widget
+        self.interval = interval
+        self.pending = None
+        self.scheduled = None
+        self.last = 0.0
+        self.received = 0
+        self.handled = 0
+
+    def push(self, handler, event):
+        self.received += 1
+        if self.pending is not None:
+            profiler.count("motion.coalesced")
+        self.pending = (handler, event)
+        if self.scheduled is None:
+            wait = self.interval - (time.perf_counter() - self.last) * 1000
+            if wait > 0:
+                self.scheduled = self.widget.after(math.ceil(wait), self.run)
+            else:
+                self.scheduled = self.widget.after_idle(self.run)
+
+    def run(self):
+        self.scheduled = None
+        if self.pending is None:
+            return
+        handler, event = self.pending
+        self.pending = None
+        self.last = time.perf_counter()
+        self.handled += 1
+        handler(event)
+
+    def flush(self):
+        # Handles whatever is still pending right now, e.g. before a release commits.
+        if self.scheduled is not None:
+            self.widget.after_cancel(self.scheduled)
+        self.run()
+
+    def cancel(self):
+        if self.scheduled is not None:
+            self.widget.after_cancel(self.scheduled)
+            self.scheduled = None
+        self.pending = None
@@ -0,0 +1,50 @@
+from PIL import Image
+
+from paint.document import Document, flatten
+from paint.tiles import LazySource
+
+
+FILETYPES = [("Gambar", "*.png;*.jpg;*.jpeg;*.webp;*.bmp;*.gif;*.tif;*.tiff"),
+             ("All files", "*.*")]
+
+# JPEG can decode straight to 1/2, 1/4 or 1/8 scale.
+DRAFT_SCALES = (8, 4, 2)
+
+
+def proxy_factor(size, viewport):
+    # The largest power of two that still leaves the proxy at least as big as the viewport.
+    factor = 1
+    while size[0] // (factor * 2) >= viewport[0] and size[1] // (factor * 2) >= viewport[1]:
+        factor *= 2
+    return factor
+
+
+def load_full(path, background, mode):
+    with Image.open(path) as image:
+        return flatten(image, background, mode)
+
+
+def open_document(path, viewport=(650, 650), background="white", tile_size=256):
+    # Returns the document plus a proxy of the image at 1/factor scale. For JPEG the proxy
+    # comes from a reduced-scale decode and the full image is only decoded once a tile is
+    # first read or edited; other formats decode once and are reduced for the proxy.
+    image = Image.open(path)
+    try:
+        size = image.size
+        factor = proxy_factor(size, viewport)
+        document = Document(size, background, tile_size=tile_size)
+        store = document.image
+        draft = next((scale for scale in DRAFT_SCALES if scale <= factor), 1)
+        if image.format == "JPEG" and draft > 1:
+            image.draft("RGB", (size[0] // draft, size[1] // draft))
+            proxy = flatten(image, background, store.mode)
+            factor = max(1, round(size[0] / proxy.width))
+            store.attach_source(LazySource(lambda: load_full(path, background, store.mode)))
+        else:
+            full = flatten(image, background, store.mode)
+            proxy = full.reduce(factor) if factor > 1 else full
+            store.attach_source(LazySource(lambda: full))
+    finally:
+        image.close()
+    document.layers.mark_dirty()
+    return document, proxy, factor
@@ -0,0 +1,174 @@
+import functools
+import json
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict, deque
+
+
+# Histogram bucket upper bounds in milliseconds; the last bucket is open-ended.
+BOUNDS_MS = (0.25, 0.5, 1, 2, 4, 8, 16, 33, 66, 133, 266)
+
+
+class Histogram:
+    def __init__(self, keep=2048):
+        self.buckets = [0] * (len(BOUNDS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=keep)
+
+    def add(self, ms):
+        self.buckets[bisect_left(BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        self.recent.append(ms)
+
+    def percentile(self, q):
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    def last(self):
+        return self.recent[-1] if self.recent else 0.0
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": self.max,
+            "buckets": {f"<={bound}" if i < len(BOUNDS_MS) else f">{BOUNDS_MS[-1]}": n
+                        for i, (bound, n) in enumerate(zip(BOUNDS_MS + (None,), self.buckets))},
+        }
+
+
+class Profiler:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.histograms = defaultdict(Histogram)
+        self.counters = Counter()
+        self.gauges = {}
+        self.clock_offset = None
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.histograms.clear()
+        self.counters.clear()
+        self.clock_offset = None
+
+    def record(self, name, ms):
+        self.histograms[name].add(ms)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] += n
+
+    def gauge(self, name, fn):
+        self.gauges[name] = fn
+
+    def event_lag(self, event):
+        # Tk event times use the display server's clock, so the smallest observed
+        # difference is taken as zero lag and everything is measured against it.
+        stamp = getattr(event, "time", None)
+        if not isinstance(stamp, int) or not stamp:
+            return
+        offset = time.monotonic() * 1000 - stamp
+        if self.clock_offset is None or offset < self.clock_offset:
+            self.clock_offset = offset
+        self.record("event_lag", offset - self.clock_offset)
+
+    def report(self):
+        return {
+            "enabled": self.enabled,
+            "timings": {name: h.summary() for name, h in sorted(self.histograms.items())},
+            "counters": dict(self.counters),
+            "gauges": {name: fn() for name, fn in self.gauges.items()},
+        }
+
+    def dump(self, path):
+        with open(path, "w") as fp:
+            json.dump(self.report(), fp, indent=2)
+        return path
+
+
+profiler = Profiler()
+
+
+def timed(name, events=False):
+    # When profiling is off the wrapper costs one attribute check.
+    def wrap(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return fn(*args, **kwargs)
+            if events and len(args) > 1:
+                profiler.event_lag(args[1])
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profiler.record(name, (time.perf_counter() - start) * 1000)
+        return wrapper
+    return wrap
+
+
+class FrameOverlay:
+    # Frame time and the busiest handlers drawn in a corner of the canvas.
+    def __init__(self, canvas, interval=250, handlers=("paint", "motion.paint", "on_release", "document.apply")):
+        self.canvas = canvas
+        self.interval = interval
+        self.handlers = handlers
+        self.scheduled = None
+
+    @property
+    def visible(self):
+        return self.scheduled is not None
+
+    def show(self):
+        profiler.enable()
+        if self.scheduled is None:
+            self.refresh()
+
+    def hide(self):
+        if self.scheduled is not None:
+            self.canvas.after_cancel(self.scheduled)
+            self.scheduled = None
+        self.canvas.delete("overlay")
+        profiler.disable()
+
+    def toggle(self):
+        if self.visible:
+            self.hide()
+        else:
+            self.show()
+
+    def text(self):
+        frame = profiler.histograms["frame"]
+        lines = [f"frame {frame.last():.1f} ms  p99 {frame.percentile(0.99):.1f} ms"]
+        for name in self.handlers:
+            h = profiler.histograms.get(name)
+            if h is not None and h.count:
+                lines.append(f"{name} {h.percentile(0.5):.2f} / {h.percentile(0.99):.2f} ms")
+        lag = profiler.histograms.get("event_lag")
+        if lag is not None and lag.count:
+            lines.append(f"lag {lag.percentile(0.5):.0f} / {lag.percentile(0.99):.0f} ms")
+        for name, fn in profiler.gauges.items():
+            value = fn()
+            if isinstance(value, dict):
+                value = " ".join(f"{k}={v}" for k, v in value.items())
+            lines.append(f"{name} {value}")
+        return "\n".join(lines)
+
+    def refresh(self):
+        self.canvas.delete("overlay")
+        self.canvas.create_text(self.canvas.canvasx(8), self.canvas.canvasy(8), anchor="nw", text=self.text(), fill="red",
+                                font=("TkFixedFont", 9), tags="overlay")
+        self.scheduled = self.canvas.after(self.interval, self.refresh)
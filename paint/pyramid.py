@@ -0,0 +1,75 @@
+from PIL import Image
+
+from paint.tiles import TileStore
+
+
+def level_size(size, level):
+    scale = 1 << level
+    return ((size[0] + scale - 1) // scale, (size[1] + scale - 1) // scale)
+
+
+class Pyramid:
+    # Downscaled copies of a canvas for zoom levels below 100%. Level k is 1/2**k; its tiles
+    # are built from level k - 1 on first use and rebuilt only where the canvas changed.
+    def __init__(self, image, tile_size=256):
+        self.image = image
+        self.tile_size = tile_size
+        self.levels = {}
+        self.built = 0
+
+    @property
+    def max_level(self):
+        # The first level where the whole canvas fits in one tile.
+        level = 0
+        while max(level_size(self.image.size, level)) > self.tile_size:
+            level += 1
+        return level
+
+    def seed(self, proxy, factor):
+        # A proxy decoded at 1/factor stands in for every level at least that small, so
+        # zoomed-out views never read full-resolution pixels.
+        for level in range(max(1, factor.bit_length() - 1), self.max_level + 1):
+            size = level_size(self.image.size, level)
+            store, valid = self.level(level)
+            store.paste(proxy.resize(size, Image.BOX) if proxy.size != size else proxy, (0, 0))
+            valid.update(store.keys((0, 0) + size))
+
+    def level(self, level):
+        if level not in self.levels:
+            size = level_size(self.image.size, level)
+            self.levels[level] = (TileStore(size, "RGB", self.image.background, self.tile_size), set())
+        return self.levels[level]
+
+    def mark_dirty(self, box=None):
+        for level, (store, valid) in list(self.levels.items()):
+            if store.size != level_size(self.image.size, level):
+                # The canvas was resized; the level starts over.
+                del self.levels[level]
+                continue
+            if box is None:
+                valid.clear()
+                continue
+            scale = 1 << level
+            scaled = store.clip((box[0] // scale, box[1] // scale,
+                                 -(-box[2] // scale), -(-box[3] // scale)))
+            if scaled is not None:
+                valid.difference_update(store.keys(scaled))
+
+    def crop(self, level, box):
+        if level == 0:
+            return self.image.crop(box)
+        store, valid = self.level(level)
+        clipped = store.clip(box)
+        if clipped is not None:
+            for key in store.keys(clipped):
+                if key not in valid:
+                    self._build(level, store, key)
+                    valid.add(key)
+        return store.crop(box)
+
+    def _build(self, level, store, key):
+        x0, y0, x1, y1 = store._intersect((0, 0) + store.size, key)
+        parent = level_size(self.image.size, level - 1)
+        region = self.crop(level - 1, (2 * x0, 2 * y0, min(2 * x1, parent[0]), min(2 * y1, parent[1])))
+        store.paste(region.reduce(2), (x0, y0))
+        self.built += 1
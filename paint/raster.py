@@ -0,0 +1,138 @@
+import math
+from PIL import Image, ImageDraw
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+BLOCK = 64
+
+# Pixel generators reproduce the classic integer Bresenham / midpoint loops exactly,
+# but compute every coordinate at once from their closed forms.
+
+def line_points(x0, y0, x1, y1):
+    dx, dy = abs(x1 - x0), abs(y1 - y0)
+    sx = 1 if x0 < x1 else -1
+    sy = 1 if y0 < y1 else -1
+    major, minor = max(dx, dy), min(dx, dy)
+    steps = np.arange(major + 1, dtype=np.int64)
+    if major:
+        offsets = (2 * minor * steps + major - 1) // (2 * major)
+    else:
+        offsets = np.zeros_like(steps)
+    if dx >= dy:
+        return x0 + sx * steps, y0 + sy * offsets
+    return x0 + sx * offsets, y0 + sy * steps
+
+
+def _isqrt(values):
+    roots = np.floor(np.sqrt(values.astype(np.float64))).astype(np.int64)
+    roots -= roots * roots > values
+    roots += (roots + 1) * (roots + 1) <= values
+    return roots
+
+
+def circle_points(xc, yc, r):
+    xs = np.arange(int(r / math.sqrt(2)) + 3, dtype=np.int64)
+    n = r * r - xs * xs
+    ys = np.where(n >= 1, (_isqrt(np.maximum(4 * n - 3, 0)) + 1) // 2, 0)
+    # The loop only ever steps y down by one, which matters at the octant boundary.
+    ys[1:] = np.maximum(ys[1:], ys[:-1] - 1)
+    last = int(np.argmax(xs >= ys))
+    xs, ys = xs[:last + 1], ys[:last + 1]
+    px = np.concatenate([xc + xs, xc - xs, xc + xs, xc - xs, xc + ys, xc - ys, xc + ys, xc - ys])
+    py = np.concatenate([yc + ys, yc + ys, yc - ys, yc - ys, yc + xs, yc + xs, yc - xs, yc - xs])
+    return px, py
+
+
+def pen_offsets(width):
+    lo, hi = -(width // 2), (width - 1) // 2
+    center = (lo + hi) / 2
+    oy, ox = np.mgrid[lo:hi + 1, lo:hi + 1]
+    disc = (ox - center) ** 2 + (oy - center) ** 2 <= (width / 2) ** 2
+    return ox[disc], oy[disc]
+
+
+def plot(image, xs, ys, color, width=1):
+    # Writes every pixel of a primitive in one store; returns the touched box.
+    if len(xs) == 0:
+        return None
+    ox, oy = pen_offsets(max(1, width))
+    w, h = image.size
+    px = (xs[:, None] + ox[None, :]).ravel()
+    py = (ys[:, None] + oy[None, :]).ravel()
+    inside = (px >= 0) & (px < w) & (py >= 0) & (py < h)
+    px, py = px[inside], py[inside]
+    if len(px) == 0:
+        return None
+    box = (int(px.min()), int(py.min()), int(px.max()) + 1, int(py.max()) + 1)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    if len(px) * 64 < area:
+        # Sparse outlines: a single C-level point() call, no copy of the region.
+        ImageDraw.Draw(image).point(np.column_stack((px, py)).ravel().tolist(), fill=color)
+    else:
+        mask = np.zeros((box[3] - box[1], box[2] - box[0]), dtype=np.uint8)
+        mask[py - box[1], px - box[0]] = 255
+        # Only blocks the primitive passes through are pasted, not its whole bounding box.
+        touched = np.zeros((mask.shape[0] // BLOCK + 1, mask.shape[1] // BLOCK + 1), dtype=bool)
+        touched[(py - box[1]) // BLOCK, (px - box[0]) // BLOCK] = True
+        for by, bx in np.argwhere(touched).tolist():
+            sub = mask[by * BLOCK:(by + 1) * BLOCK, bx * BLOCK:(bx + 1) * BLOCK]
+            x, y = box[0] + bx * BLOCK, box[1] + by * BLOCK
+            image.paste(color, (x, y, x + sub.shape[1], y + sub.shape[0]), Image.fromarray(sub))
+    return box
+
+
+def _line_points_py(x0, y0, x1, y1):
+    dx, dy = abs(x1 - x0), abs(y1 - y0)
+    sx = 1 if x0 < x1 else -1
+    sy = 1 if y0 < y1 else -1
+    major, minor = max(dx, dy), min(dx, dy)
+    points = []
+    for i in range(major + 1):
+        offset = (2 * minor * i + major - 1) // (2 * major) if major else 0
+        points.append((x0 + sx * i, y0 + sy * offset) if dx >= dy else (x0 + sx * offset, y0 + sy * i))
+    return points
+
+
+def _circle_points_py(xc, yc, r):
+    points = []
+    x, y = 0, r
+    while True:
+        n = r * r - x * x
+        y = max((math.isqrt(4 * n - 3) + 1) // 2 if n >= 1 else 0, y - 1)
+        points += [(xc + x, yc + y), (xc - x, yc + y), (xc + x, yc - y), (xc - x, yc - y),
+                   (xc + y, yc + x), (xc - y, yc + x), (xc + y, yc - x), (xc - y, yc - x)]
+        if not x < y:
+            return points
+        x += 1
+
+
+def _plot_py(image, points, color, width=1):
+    lo, hi = -(width // 2), (width - 1) // 2
+    center = (lo + hi) / 2
+    stamp = [(dx, dy) for dy in range(lo, hi + 1) for dx in range(lo, hi + 1)
+             if (dx - center) ** 2 + (dy - center) ** 2 <= (width / 2) ** 2]
+    w, h = image.size
+    pixels = [(x + dx, y + dy) for x, y in points for dx, dy in stamp
+              if 0 <= x + dx < w and 0 <= y + dy < h]
+    if not pixels:
+        return None
+    ImageDraw.Draw(image).point(pixels, fill=color)
+    xs, ys = [p[0] for p in pixels], [p[1] for p in pixels]
+    return (min(xs), min(ys), max(xs) + 1, max(ys) + 1)
+
+
+def draw_line(image, x0, y0, x1, y1, color, width=1):
+    if np is None:
+        return _plot_py(image, _line_points_py(x0, y0, x1, y1), color, max(1, width))
+    xs, ys = line_points(x0, y0, x1, y1)
+    return plot(image, xs, ys, color, width)
+
+
+def draw_circle(image, xc, yc, r, color, width=1):
+    if np is None:
+        return _plot_py(image, _circle_points_py(xc, yc, r), color, max(1, width))
+    xs, ys = circle_points(xc, yc, r)
+    return plot(image, xs, ys, color, width)
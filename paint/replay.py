@@ -0,0 +1,30 @@
+import argparse
+import time
+
+from paint import commands
+from paint.document import replay
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply a recorded command stream without a GUI.")
+    parser.add_argument("commands", help="JSON lines file written by paint.commands.dump")
+    parser.add_argument("output", help="image file to write")
+    parser.add_argument("--size", type=parse_size, default=(650, 650), help="canvas size, e.g. 650x650")
+    args = parser.parse_args(argv)
+
+    with open(args.commands) as fp:
+        command_list = commands.load(fp)
+    start = time.perf_counter()
+    document = replay(command_list, args.size)
+    elapsed = time.perf_counter() - start
+    document.layers.save(args.output)
+    print(f"{len(command_list)} commands in {elapsed * 1000:.1f} ms -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+
+FORMATS = {"png": "PNG", "jpg": "JPEG", "jpeg": "JPEG", "webp": "WEBP"}
+
+
+def format_for(path):
+    # PNG when the name has no extension; otherwise whatever Pillow writes for it.
+    extension = os.path.splitext(path)[1].lower()
+    if not extension:
+        return "PNG"
+    if extension.lstrip(".") in FORMATS:
+        return FORMATS[extension.lstrip(".")]
+    format = Image.registered_extensions().get(extension)
+    if format is None or format not in Image.SAVE:
+        raise ValueError(f"unknown file extension: {extension}")
+    return format
+
+
+def encoder_options(format, compress_level=6, optimize=False, quality=90):
+    if format == "PNG":
+        return {"compress_level": compress_level, "optimize": optimize}
+    if format == "JPEG":
+        return {"quality": quality, "optimize": optimize}
+    if format == "WEBP":
+        return {"quality": quality, "method": 6 if optimize else 4}
+    return {}
+
+
+def snapshot(image):
+    if hasattr(image, "snapshot"):
+        return image.snapshot()
+    return image.copy()
+
+
+class _Counter:
+    # Pillow writes through fileno() when it can; hiding it routes every chunk through write().
+    def __init__(self, fp, job):
+        self.fp = fp
+        self.job = job
+
+    def write(self, data):
+        self.job.written += len(data)
+        return self.fp.write(data)
+
+    def fileno(self):
+        raise io.UnsupportedOperation("fileno")
+
+    def __getattr__(self, name):
+        return getattr(self.fp, name)
+
+
+class SaveJob:
+    def __init__(self, image, path, format, options):
+        self.image = image
+        self.path = path
+        self.format = format
+        self.options = options
+        self.callbacks = []
+        self.merged = 0
+        self.state = "queued"
+        self.written = 0
+        self.error = None
+
+    def run(self):
+        self.state = "encoding"
+        image = self.image.to_image() if hasattr(self.image, "to_image") else self.image
+        if self.format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        # A failed or interrupted save never leaves a truncated file at the target path.
+        partial = f"{self.path}.part-{threading.get_ident()}"
+        try:
+            with open(partial, "wb") as fp:
+                image.save(_Counter(fp, self), self.format, **self.options)
+            os.replace(partial, self.path)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        finally:
+            self.image = None
+        self.state = "done"
+
+
+class Saver:
+    # Encodes on worker threads (Pillow releases the GIL while compressing). Callbacks
+    # only run from poll(), so a Tk frontend can drive it with root.after.
+    def __init__(self, workers=1):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="save")
+        self.running = {}
+        self.pending = OrderedDict()
+        self.merged = 0
+
+    def save(self, image, path, format=None, on_done=None, **options):
+        format = format or format_for(path)
+        job = SaveJob(snapshot(image), path, format, options)
+        if on_done is not None:
+            job.callbacks.append(on_done)
+        # A newer save to the same file replaces one that has not started yet.
+        older = self.pending.pop(path, None)
+        if older is not None:
+            job.callbacks = older.callbacks + job.callbacks
+            job.merged = older.merged + 1
+            self.merged += 1
+        if path in self.running:
+            self.pending[path] = job
+        else:
+            self._start(job)
+        return job
+
+    def poll(self):
+        for path, (job, future) in list(self.running.items()):
+            if not future.done():
+                continue
+            del self.running[path]
+            job.error = future.exception()
+            if job.error is not None:
+                job.state = "failed"
+            for callback in job.callbacks:
+                callback(job)
+            following = self.pending.pop(path, None)
+            if following is not None:
+                self._start(following)
+        return self.busy()
+
+    def busy(self):
+        return bool(self.running or self.pending)
+
+    def progress(self):
+        return [(job.path, job.state, job.written) for job, _ in self.running.values()]
+
+    def wait(self):
+        while self.busy():
+            for _, future in list(self.running.values()):
+                future.exception()
+            self.poll()
+
+    def shutdown(self):
+        self.wait()
+        self.executor.shutdown()
+
+    def _start(self, job):
+        self.running[job.path] = (job, self.executor.submit(job.run))
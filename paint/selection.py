@@ -0,0 +1,123 @@
+import math
+
+from PIL import Image
+
+from paint import commands
+
+
+# Rotations that are exact as transposes (angles are clockwise on screen).
+QUARTER_TURNS = {0: None, 90: Image.ROTATE_270, 180: Image.ROTATE_180, 270: Image.ROTATE_90}
+
+
+class FloatingSelection:
+    # A lifted region of a layer with a pending affine transform. It only holds the source
+    # store and box; pixels are read the first time a preview or the commit needs them.
+    def __init__(self, source, box, dx=0, dy=0, angle=0.0, scale_x=1.0, scale_y=1.0):
+        self.source = source
+        self.box = tuple(int(v) for v in box)
+        self.dx, self.dy = dx, dy
+        self.angle = angle % 360
+        self.scale_x, self.scale_y = scale_x, scale_y
+        self._pixels = None
+        self._preview = None
+        self._preview_key = None
+
+    @classmethod
+    def from_command(cls, source, command):
+        return cls(source, command.box, command.dx, command.dy, command.angle,
+                   command.scale_x, command.scale_y)
+
+    def command(self):
+        return commands.TransformSelection(self.box, self.dx, self.dy, self.angle,
+                                           self.scale_x, self.scale_y)
+
+    @property
+    def size(self):
+        return (self.box[2] - self.box[0], self.box[3] - self.box[1])
+
+    def is_identity(self):
+        return (self.dx == self.dy == 0 and self.angle == 0
+                and self.scale_x == self.scale_y == 1)
+
+    def pixels(self):
+        if self._pixels is None:
+            self._pixels = self.source.crop(self.box).convert("RGBA")
+        return self._pixels
+
+    def move_to(self, x, y):
+        self.dx, self.dy = x - self.box[0], y - self.box[1]
+
+    def rotate(self, degrees):
+        self.angle = (self.angle + degrees) % 360
+
+    def scale(self, fx, fy=None):
+        self.scale_x *= fx
+        self.scale_y *= fx if fy is None else fy
+
+    def flip(self, horizontal=True):
+        # Mirroring on screen after a rotation is the mirrored source turned the other way.
+        self.angle = -self.angle % 360
+        if horizontal:
+            self.scale_x = -self.scale_x
+        else:
+            self.scale_y = -self.scale_y
+
+    def extent(self):
+        # Canvas box of the transformed pixels before the move, rotating about the centre.
+        w, h = self.size
+        cx, cy = self.box[0] + w / 2, self.box[1] + h / 2
+        cos, sin = self._rotation()
+        xs, ys = [], []
+        for u, v in ((-w / 2, -h / 2), (w / 2, -h / 2), (w / 2, h / 2), (-w / 2, h / 2)):
+            u, v = u * self.scale_x, v * self.scale_y
+            xs.append(cx + cos * u - sin * v)
+            ys.append(cy + sin * u + cos * v)
+        # Rounding before floor/ceil keeps float noise from adding a column.
+        return (math.floor(round(min(xs), 6)), math.floor(round(min(ys), 6)),
+                math.ceil(round(max(xs), 6)), math.ceil(round(max(ys), 6)))
+
+    def bounds(self):
+        x0, y0, x1, y1 = self.extent()
+        return (x0 + self.dx, y0 + self.dy, x1 + self.dx, y1 + self.dy)
+
+    def render(self, resample=Image.BICUBIC):
+        # Returns the transformed pixels and the canvas position of their top-left corner,
+        # ignoring the move.
+        pixels = self.pixels()
+        x0, y0, x1, y1 = self.extent()
+        if self.angle in QUARTER_TURNS and abs(self.scale_x) == abs(self.scale_y) == 1:
+            if self.scale_x < 0:
+                pixels = pixels.transpose(Image.FLIP_LEFT_RIGHT)
+            if self.scale_y < 0:
+                pixels = pixels.transpose(Image.FLIP_TOP_BOTTOM)
+            if QUARTER_TURNS[self.angle] is not None:
+                pixels = pixels.transpose(QUARTER_TURNS[self.angle])
+            return pixels, (x0, y0)
+
+        w, h = pixels.size
+        cos, sin = self._rotation()
+        sx, sy = self.scale_x, self.scale_y
+        qx = x0 - (self.box[0] + w / 2)
+        qy = y0 - (self.box[1] + h / 2)
+        # Inverse mapping from output pixels back into the source region.
+        data = (cos / sx, sin / sx, w / 2 + (cos * qx + sin * qy) / sx,
+                -sin / sy, cos / sy, h / 2 + (-sin * qx + cos * qy) / sy)
+        if resample != Image.NEAREST:
+            # Premultiplied alpha, so transparent edges do not bleed dark fringes.
+            pixels = pixels.convert("RGBa")
+        out = pixels.transform((x1 - x0, y1 - y0), Image.AFFINE, data, resample,
+                               fillcolor=(0, 0, 0, 0))
+        return out.convert("RGBA") if out.mode == "RGBa" else out, (x0, y0)
+
+    def preview(self):
+        # Nearest-neighbour and cached per transform, so dragging only moves it.
+        key = (self.angle, self.scale_x, self.scale_y)
+        if key != self._preview_key:
+            self._preview = self.render(Image.NEAREST)
+            self._preview_key = key
+        image, (x, y) = self._preview
+        return image, (x + self.dx, y + self.dy)
+
+    def _rotation(self):
+        radians = math.radians(self.angle)
+        return math.cos(radians), math.sin(radians)
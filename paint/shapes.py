@@ -0,0 +1,185 @@
+from collections import OrderedDict
+from functools import lru_cache
+
+from PIL import Image, ImageDraw
+
+from paint import colors, raster
+
+
+# Offsets of the pseudo-3D faces, and the colours they are drawn in.
+SHADOW_OFFSET = 10
+CIRCLE_SHADOW_OFFSET = 5
+SHADOW = "gray"
+EDGE = "darkgray"
+
+
+def bounds(tool, x0, y0, x1, y1, width):
+    if tool in ["circle", "circle3d"]:
+        r = max(abs(x1 - x0), abs(y1 - y0))
+        x0, y0, x1, y1 = x0 - r, y0 - r, x0 + r, y0 + r
+    elif tool == "circle_midpoint":
+        xc, yc = (x0 + x1) // 2, (y0 + y1) // 2
+        r = max(abs(x1 - x0), abs(y1 - y0)) // 2
+        x0, y0, x1, y1 = xc - r, yc - r, xc + r, yc + r
+    # Room for the pen width and the 3D shadow offsets.
+    pad = width + SHADOW_OFFSET + 1
+    return (min(x0, x1) - pad, min(y0, y1) - pad, max(x0, x1) + pad, max(y0, y1) + pad)
+
+
+@lru_cache(maxsize=256)
+def geometry(tool, dx, dy, width):
+    # The shape as (op, points, options) with the press point at (0, 0). Colour options name
+    # a role ("color", SHADOW or EDGE) that is resolved when drawing. Shapes only depend on
+    # the drag vector, so one drag state is built once however often it is drawn.
+    if tool == "line":
+        return (("line", ((0, 0), (dx, dy)), {"fill": "color", "width": width}),)
+    if tool == "line_bresenham":
+        return (("raster_line", ((0, 0), (dx, dy)), {"fill": "color", "width": width}),)
+    # ImageDraw wants the top-left corner first, whichever way the drag went.
+    lx, ly, hx, hy = min(0, dx), min(0, dy), max(0, dx), max(0, dy)
+    if tool == "rectangle":
+        return (("rectangle", ((lx, ly), (hx, hy)), {"outline": "color", "width": width}),)
+    if tool == "oval":
+        return (("ellipse", ((lx, ly), (hx, hy)), {"outline": "color", "width": width}),)
+    if tool == "circle_midpoint":
+        r = max(abs(dx), abs(dy)) // 2
+        return (("raster_circle", ((dx // 2, dy // 2),), {"fill": "color", "width": width, "r": r}),)
+    if tool == "circle":
+        r = max(abs(dx), abs(dy))
+        return (("ellipse", ((-r, -r), (r, r)), {"outline": "color", "width": width}),)
+    apex = dx // 2
+    if tool == "triangle":
+        return (("polygon", ((0, dy), (apex, 0), (dx, dy)), {"outline": "color", "width": width}),)
+    o = SHADOW_OFFSET
+    if tool == "rectangle3d":
+        return (
+            ("rectangle", ((lx, ly), (hx, hy)), {"fill": "color", "outline": "color", "width": width}),
+            ("rectangle", ((lx + o, ly - o), (hx + o, hy - o)), {"fill": SHADOW, "outline": SHADOW}),
+            ("polygon", ((lx, ly), (lx + o, ly - o), (lx + o, hy - o), (lx, hy)), {"fill": EDGE}),
+            ("polygon", ((hx, ly), (hx + o, ly - o), (hx + o, hy - o), (hx, hy)), {"fill": EDGE}),
+        )
+    if tool == "circle3d":
+        r, c = max(abs(dx), abs(dy)), CIRCLE_SHADOW_OFFSET
+        return (
+            ("ellipse", ((-r, -r), (r, r)), {"fill": "color", "outline": "color", "width": width}),
+            ("ellipse", ((c - r, -c - r), (c + r, r - c)), {"fill": SHADOW, "outline": SHADOW, "width": 1}),
+        )
+    if tool == "triangle3d":
+        base = ((0, dy), (apex, 0), (dx, dy))
+        shadow = tuple((x + o, y - o) for x, y in base)
+        return (
+            ("polygon", base, {"fill": "color", "outline": "color"}),
+            ("polygon", shadow, {"fill": SHADOW, "outline": SHADOW}),
+        ) + tuple(("line", (a, b), {"fill": EDGE}) for a, b in zip(base, shadow))
+    raise ValueError(f"Unknown shape tool {tool!r}")
+
+
+def rasterized(primitives):
+    # Shapes drawn pixel by pixel in Python. Only these are worth a sprite: ImageDraw's own
+    # primitives draw faster than a masked paste of the same pixels.
+    return any(op.startswith("raster_") for op, _, _ in primitives)
+
+
+def draw(image, primitives, x, y, palette):
+    # Draws primitives translated by (x, y); palette maps colour roles to pixel values.
+    target = ImageDraw.Draw(image)
+    for op, points, options in primitives:
+        points = [(px + x, py + y) for px, py in points]
+        options = {k: palette[v] if k in ("fill", "outline") else v for k, v in options.items()}
+        if op == "raster_line":
+            (x0, y0), (x1, y1) = points
+            raster.draw_line(image, x0, y0, x1, y1, options["fill"], options["width"])
+        elif op == "raster_circle":
+            (xc, yc), = points
+            raster.draw_circle(image, xc, yc, options["r"], options["fill"], options["width"])
+        elif op in ("rectangle", "ellipse"):
+            getattr(target, op)([points[0][0], points[0][1], points[1][0], points[1][1]], **options)
+        else:
+            getattr(target, op)(points, **options)
+
+
+def outline(tool, x0, y0, x1, y1, width):
+    # The shape as canvas items for a live preview: (kind, flat coords) with kind one of
+    # "line", "rectangle", "oval" or "polygon". The item list only depends on the tool, so
+    # a preview can create its items once and move them with coords() afterwards.
+    items = []
+    for op, points, options in geometry(tool, x1 - x0, y1 - y0, width):
+        coords = [v + (y0 if i % 2 else x0) for i, v in enumerate(sum(points, ()))]
+        if op == "raster_circle":
+            xc, yc = coords
+            r = options["r"]
+            items.append(("oval", [xc - r, yc - r, xc + r, yc + r]))
+        elif op == "raster_line":
+            items.append(("line", coords))
+        else:
+            items.append(({"ellipse": "oval"}.get(op, op), coords))
+    return items
+
+
+class SpriteCache:
+    # Rendered shapes as (pixels, mask) pairs, least recently used first out once the byte
+    # budget is exceeded. A shape is only rendered into a sprite the second time it is
+    # drawn, so one-off shapes are drawn in place and cost nothing extra.
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_area=256 * 256, max_seen=1024):
+        self.max_bytes = max_bytes
+        self.max_area = max_area
+        self.max_seen = max_seen
+        self.sprites = OrderedDict()
+        self.seen = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        sprite = self.sprites.get(key)
+        if sprite is not None:
+            self.sprites.move_to_end(key)
+            self.hits += 1
+            return sprite
+        self.misses += 1
+        return None
+
+    def wanted(self, key, size):
+        # True on a repeat of a small shape. A paste covers the whole box while the shape
+        # only touches its outline, so past max_area drawing it again is as fast.
+        if size[0] * size[1] > self.max_area:
+            return False
+        if key in self.seen:
+            return True
+        self.seen[key] = True
+        if len(self.seen) > self.max_seen:
+            self.seen.popitem(last=False)
+        return False
+
+    def put(self, key, sprite):
+        pixels, mask = sprite
+        self.sprites[key] = sprite
+        self.bytes += len(pixels.getbands()) * pixels.width * pixels.height + mask.width * mask.height
+        while self.bytes > self.max_bytes and len(self.sprites) > 1:
+            _, (old, old_mask) = self.sprites.popitem(last=False)
+            self.bytes -= len(old.getbands()) * old.width * old.height + old_mask.width * old_mask.height
+
+    def clear(self):
+        self.sprites.clear()
+        self.seen.clear()
+        self.bytes = 0
+
+    def stats(self):
+        return {"sprites": len(self.sprites), "bytes": self.bytes, "hits": self.hits, "misses": self.misses}
+
+
+def palette(color, mode):
+    return {"color": colors.resolve(color, mode), SHADOW: colors.resolve(SHADOW, mode),
+            EDGE: colors.resolve(EDGE, mode)}
+
+
+def render(tool, dx, dy, color, width, mode):
+    # The shape on its own: pixels in mode plus an "L" mask of exactly the pixels it sets.
+    x0, y0, x1, y1 = bounds(tool, 0, 0, dx, dy, width)
+    size = (x1 - x0, y1 - y0)
+    primitives = geometry(tool, dx, dy, width)
+    pixels = Image.new(mode, size)
+    draw(pixels, primitives, -x0, -y0, palette(color, mode))
+    mask = Image.new("L", size, 0)
+    draw(mask, primitives, -x0, -y0, {"color": 255, SHADOW: 255, EDGE: 255})
+    return pixels, mask
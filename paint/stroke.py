@@ -0,0 +1,41 @@
+from paint.tiles import union
+
+
+class Stroke:
+    # Freehand points are collected as they arrive and rasterized in batches.
+    def __init__(self, x, y, color, width):
+        self.points = [(x, y)]
+        self.color = color
+        self.width = width
+        self.drawn = 0
+        self.box = None
+
+    def add(self, x, y):
+        if (x, y) != self.points[-1]:
+            self.points.append((x, y))
+
+    def pending_box(self):
+        pending = self.points[self.drawn:]
+        if len(pending) < 2:
+            return None
+        pad = self.width // 2 + 2
+        xs = [p[0] for p in pending]
+        ys = [p[1] for p in pending]
+        return (min(xs) - pad, min(ys) - pad, max(xs) + pad + 1, max(ys) + pad + 1)
+
+    def rasterize(self, image):
+        box = self.pending_box()
+        if box is None:
+            return None
+        pending = self.points[self.drawn:]
+        with image.edit(box) as draw:
+            draw.line(pending, fill=self.color, width=self.width)
+            if self.width > 2:
+                # A disc on every vertex gives round joins and makes the result
+                # independent of how the points were split into batches.
+                r = (self.width - 1) / 2
+                for x, y in pending:
+                    draw.ellipse((x - r, y - r, x + r, y + r), fill=self.color)
+        self.drawn = len(self.points) - 1
+        self.box = union(self.box, box)
+        return box
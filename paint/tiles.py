@@ -0,0 +1,338 @@
+import mmap
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from PIL import Image, ImageDraw
+
+from paint import colors
+
+
+def union(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+class Spill:
+    # Fixed-size tile slots in a memory-mapped file, for tiles evicted from RAM.
+    def __init__(self, path, slot_size):
+        self.file = open(path, "w+b")
+        self.slot_size = slot_size
+        self.capacity = 0
+        self.used = 0
+        self.map = None
+
+    def allocate(self):
+        if self.used == self.capacity:
+            self._grow(max(16, self.capacity * 2))
+        self.used += 1
+        return self.used - 1
+
+    def write(self, slot, data):
+        offset = slot * self.slot_size
+        self.map[offset:offset + self.slot_size] = data
+
+    def read(self, slot):
+        offset = slot * self.slot_size
+        return self.map[offset:offset + self.slot_size]
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def _grow(self, capacity):
+        if self.map is not None:
+            self.map.close()
+        self.file.truncate(capacity * self.slot_size)
+        self.map = mmap.mmap(self.file.fileno(), capacity * self.slot_size)
+        self.capacity = capacity
+
+
+class LazySource:
+    # Full-resolution pixels behind a store's pending tiles. Decoded on first use and
+    # read-only afterwards, so snapshots and worker threads can share it.
+    def __init__(self, load):
+        self.load = load
+        self.image = None
+        self.lock = threading.Lock()
+
+    def crop(self, box):
+        with self.lock:
+            if self.image is None:
+                self.image = self.load()
+                self.load = None
+        # The store may have grown past the source; only the source's own pixels are returned.
+        x0, y0, x1, y1 = box
+        return self.image.crop((x0, y0, min(x1, self.image.width), min(y1, self.image.height)))
+
+
+class RegionDraw:
+    # ImageDraw over a cropped region, taking canvas coordinates.
+    def __init__(self, image, origin):
+        self.image = image
+        self.origin = origin
+        self.draw = ImageDraw.Draw(image)
+
+    def shift(self, xy):
+        ox, oy = self.origin
+        if xy and isinstance(xy[0], (tuple, list)):
+            return [(x - ox, y - oy) for x, y in xy]
+        return [v - (oy if i % 2 else ox) for i, v in enumerate(xy)]
+
+    def line(self, xy, **kwargs):
+        self.draw.line(self.shift(xy), **kwargs)
+
+    def rectangle(self, xy, **kwargs):
+        self.draw.rectangle(self.shift(xy), **kwargs)
+
+    def ellipse(self, xy, **kwargs):
+        self.draw.ellipse(self.shift(xy), **kwargs)
+
+    def polygon(self, xy, **kwargs):
+        self.draw.polygon(self.shift(xy), **kwargs)
+
+    def point(self, xy, **kwargs):
+        self.draw.point(self.shift(xy), **kwargs)
+
+    def paste(self, image, xy, mask=None):
+        self.image.paste(image, tuple(self.shift(xy)), mask)
+
+    def composite(self, image, xy):
+        # Lays RGBA pixels over the region, respecting their alpha.
+        x, y = self.shift(xy)
+        if self.image.mode == "RGBA":
+            self.image.alpha_composite(image, (x, y))
+        else:
+            self.image.paste(image.convert(self.image.mode), (x, y), image.getchannel("A"))
+
+
+class TileStore:
+    # Canvas pixels kept as lazily allocated square tiles; untouched tiles are background.
+    def __init__(self, size, mode="RGB", background="white", tile_size=256,
+                 spill_path=None, max_resident=None):
+        self.width, self.height = size
+        self.mode = mode
+        self.background = background
+        self.tile_size = tile_size
+        self.fill_value = colors.resolve(background, mode)
+        self.tiles = OrderedDict()
+        self.slots = {}
+        self.spilled = set()
+        self.max_resident = max_resident
+        self.spill = None
+        self.source = None
+        self.pending = set()
+        if spill_path is not None:
+            bands = Image.getmodebands(mode)
+            self.spill = Spill(spill_path, tile_size * tile_size * bands)
+
+    @classmethod
+    def from_image(cls, image, **kwargs):
+        kwargs.setdefault("mode", image.mode)
+        store = cls(image.size, **kwargs)
+        store.paste(image, (0, 0))
+        return store
+
+    @property
+    def size(self):
+        return (self.width, self.height)
+
+    def resize(self, size):
+        # Growing only moves the logical edge; nothing is copied or allocated.
+        w, h = size
+        if w < self.width or h < self.height:
+            t = self.tile_size
+            for key in self.allocated_keys():
+                x0, y0 = key[0] * t, key[1] * t
+                if x0 >= w or y0 >= h:
+                    self.tiles.pop(key, None)
+                    self.spilled.discard(key)
+                    self.pending.discard(key)
+                elif x0 + t > w or y0 + t > h:
+                    draw = ImageDraw.Draw(self.tile(key))
+                    if x0 + t > w:
+                        draw.rectangle((w - x0, 0, t, t), fill=self.fill_value)
+                    if y0 + t > h:
+                        draw.rectangle((0, h - y0, t, t), fill=self.fill_value)
+        self.width, self.height = size
+
+    def keys(self, box):
+        t = self.tile_size
+        x0, y0, x1, y1 = box
+        for ty in range(y0 // t, (y1 - 1) // t + 1):
+            for tx in range(x0 // t, (x1 - 1) // t + 1):
+                yield (tx, ty)
+
+    def tile(self, key, create=False):
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+        if key in self.spilled:
+            self.spilled.discard(key)
+            data = self.spill.read(self.slots[key])
+            tile = Image.frombytes(self.mode, (self.tile_size, self.tile_size), data)
+        elif key in self.pending:
+            tile = self._load(key)
+        elif create:
+            tile = Image.new(self.mode, (self.tile_size, self.tile_size), self.fill_value)
+        else:
+            return None
+        self.tiles[key] = tile
+        self.pending.discard(key)
+        self._evict()
+        return tile
+
+    def is_allocated(self, key):
+        return key in self.tiles or key in self.spilled or key in self.pending
+
+    def allocated_keys(self):
+        return list(self.tiles) + list(self.spilled) + list(self.pending)
+
+    def attach_source(self, source):
+        # Every tile reads from source until it is first touched; nothing is copied yet.
+        self.source = source
+        self.pending = set(self.keys((0, 0) + self.size))
+
+    def crop(self, box):
+        x0, y0, x1, y1 = (int(v) for v in box)
+        out = Image.new(self.mode, (max(0, x1 - x0), max(0, y1 - y0)), self.fill_value)
+        clipped = self.clip(box)
+        if clipped is None:
+            return out
+        t = self.tile_size
+        for key in self.keys(clipped):
+            tile = self.tile(key)
+            if tile is None:
+                continue
+            part = self._intersect(clipped, key)
+            out.paste(tile.crop((part[0] - key[0] * t, part[1] - key[1] * t,
+                                 part[2] - key[0] * t, part[3] - key[1] * t)),
+                      (part[0] - x0, part[1] - y0))
+        return out
+
+    def paste(self, image, xy):
+        x0, y0 = int(xy[0]), int(xy[1])
+        clipped = self.clip((x0, y0, x0 + image.width, y0 + image.height))
+        if clipped is None:
+            return
+        t = self.tile_size
+        for key in self.keys(clipped):
+            part = self._intersect(clipped, key)
+            region = image.crop((part[0] - x0, part[1] - y0, part[2] - x0, part[3] - y0))
+            if not self.is_allocated(key) and self._is_background(region):
+                continue
+            self.tile(key, create=True).paste(region, (part[0] - key[0] * t, part[1] - key[1] * t))
+
+    @contextmanager
+    def edit(self, box):
+        clipped = self.clip(box)
+        if clipped is None:
+            yield RegionDraw(Image.new(self.mode, (1, 1), self.fill_value), (int(box[0]), int(box[1])))
+            return
+        region = RegionDraw(self.crop(clipped), clipped[:2])
+        yield region
+        self.paste(region.image, clipped[:2])
+
+    def getpixel(self, xy):
+        t = self.tile_size
+        tile = self.tile((xy[0] // t, xy[1] // t))
+        if tile is None:
+            return self.fill_value
+        return tile.getpixel((xy[0] % t, xy[1] % t))
+
+    def to_image(self):
+        return self.crop((0, 0, self.width, self.height))
+
+    def save(self, fp, format=None, **params):
+        self.to_image().save(fp, format, **params)
+
+    def snapshot(self):
+        # Copies only the allocated tiles, so it is cheap enough to take on the UI thread.
+        out = TileStore(self.size, self.mode, self.background, self.tile_size)
+        for key in list(self.tiles) + list(self.spilled):
+            out.tiles[key] = self.tile(key).copy()
+        out.source, out.pending = self.source, set(self.pending)
+        return out
+
+    def transpose(self, method):
+        # Each destination tile pulls its source region, so empty areas stay unallocated.
+        if method in (Image.ROTATE_90, Image.ROTATE_270, Image.TRANSPOSE, Image.TRANSVERSE):
+            size = (self.height, self.width)
+        else:
+            size = self.size
+        out = TileStore(size, self.mode, self.background, self.tile_size)
+        for key in out.keys((0, 0) + size):
+            box = out._intersect((0, 0) + size, key)
+            source = self._source_box(method, box)
+            if not any(self.is_allocated(k) for k in self.keys(source)):
+                continue
+            out.paste(self.crop(source).transpose(method), box[:2])
+        return out
+
+    def clip(self, box):
+        x0, y0 = max(0, int(box[0])), max(0, int(box[1]))
+        x1, y1 = min(self.width, int(box[2])), min(self.height, int(box[3]))
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return (x0, y0, x1, y1)
+
+    def allocated_tiles(self):
+        return len(self.tiles) + len(self.spilled) + len(self.pending)
+
+    def resident_bytes(self):
+        return sum(len(tile.getbands()) * tile.width * tile.height for tile in self.tiles.values())
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
+
+    def _source_box(self, method, box):
+        w, h = self.size
+        x0, y0, x1, y1 = box
+        if method == Image.FLIP_LEFT_RIGHT:
+            return (w - x1, y0, w - x0, y1)
+        if method == Image.FLIP_TOP_BOTTOM:
+            return (x0, h - y1, x1, h - y0)
+        if method == Image.ROTATE_180:
+            return (w - x1, h - y1, w - x0, h - y0)
+        if method == Image.ROTATE_90:
+            return (w - y1, x0, w - y0, x1)
+        if method == Image.ROTATE_270:
+            return (y0, h - x1, y1, h - x0)
+        if method == Image.TRANSPOSE:
+            return (y0, x0, y1, x1)
+        return (w - y1, h - x1, w - y0, h - x0)
+
+    def _intersect(self, box, key):
+        t = self.tile_size
+        return (max(box[0], key[0] * t), max(box[1], key[1] * t),
+                min(box[2], key[0] * t + t), min(box[3], key[1] * t + t))
+
+    def _load(self, key):
+        # Pending tiles are materialized from the source the first time they are read or edited.
+        t = self.tile_size
+        box = self._intersect((0, 0) + self.size, key)
+        tile = Image.new(self.mode, (t, t), self.fill_value)
+        tile.paste(self.source.crop(box), (0, 0))
+        return tile
+
+    def _is_background(self, region):
+        extrema = region.getextrema()
+        if not isinstance(extrema[0], tuple):
+            extrema = (extrema,)
+        value = self.fill_value if isinstance(self.fill_value, tuple) else (self.fill_value,)
+        return all(lo == hi == v for (lo, hi), v in zip(extrema, value))
+
+    def _evict(self):
+        if self.spill is None or self.max_resident is None:
+            return
+        while len(self.tiles) > self.max_resident:
+            key, tile = self.tiles.popitem(last=False)
+            if key not in self.slots:
+                self.slots[key] = self.spill.allocate()
+            self.spill.write(self.slots[key], tile.tobytes())
+            self.spilled.add(key)
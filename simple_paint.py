@@ -1,12 +1,22 @@
+import os
+import time
 import tkinter as tk
-from tkinter import colorchooser, filedialog
-from PIL import Image, ImageDraw, ImageTk
-import copy
+from tkinter import colorchooser, filedialog, messagebox
+from PIL import ImageTk
+from paint import colors, commands, journal, opening, saving, shapes
+from paint.display import Display
+from paint.document import Document
+from paint.executor import TileExecutor
+from paint.layers import BLENDS
+from paint.motion import MotionScheduler
+from paint.profiling import FrameOverlay, profiler, timed
+from paint.selection import FloatingSelection
 
 class PaintApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Simple Paint")
+        colors.use_tk(self.root)
 
         self.canvas_width = 650
         self.canvas_height = 650
@@ -14,10 +24,28 @@ class PaintApp:
         self.pen_color = "black"
         self.pen_size = 5
         self.tool = "pencil"
-
-        self.image = Image.new("RGB", (self.canvas_width, self.canvas_height), "white")
-        self.draw = ImageDraw.Draw(self.image)
-        self.undo_stack = []
+        self.fill_tolerance = 0
+        self.fill_connectivity = 4
+        self.save_quality = 90
+        self.save_compress_level = 6
+        self.save_optimize = False
+
+        self.document = Document((self.canvas_width, self.canvas_height))
+        # A session directory left behind means the last run did not exit cleanly.
+        journal_dir = journal.claim(journal.default_directory())
+        if journal.has_session(journal_dir) and messagebox.askyesno(
+                "Simple Paint", "Sesi sebelumnya tidak ditutup dengan benar. Pulihkan?"):
+            try:
+                self.document = journal.recover(journal_dir)
+                self.canvas_width, self.canvas_height = self.document.size
+            except Exception as error:
+                # Whatever went wrong, the crash data is kept rather than replaced.
+                kept = journal.set_aside(journal_dir)
+                messagebox.showerror("Simple Paint", f"Gagal memulihkan sesi: {error}\n"
+                                                     f"Data sesi disimpan di {kept}")
+        self.journal = journal.Journal(journal_dir)
+        self.journal.attach(self.document)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
         self.canvas_frame = tk.Frame(self.root, width=self.canvas_width, height=self.canvas_height)
         self.canvas_frame.pack(side=tk.RIGHT, expand=True)
@@ -26,16 +54,29 @@ class PaintApp:
         self.canvas = tk.Canvas(self.canvas_frame, bg="white",
                                 width=self.canvas_width, height=self.canvas_height)
         self.canvas.pack(expand=True)
+        self.display = Display(self.canvas)
+        self.overlay = FrameOverlay(self.canvas)
+        self.motion = MotionScheduler(self.canvas)
+        self.hover = MotionScheduler(self.canvas)
+        profiler.gauge("photo", lambda: {"rebuilds": self.display.rebuilds,
+                                         "tiles": self.display.pushed_tiles,
+                                         "MB": round(self.display.pushed_bytes / 2 ** 20, 1)})
 
         self.canvas.bind("<B1-Motion>", self.paint)
         self.canvas.bind("<ButtonPress-1>", self.on_press)
         self.canvas.bind("<ButtonRelease-1>", self.on_release)
-        self.canvas.bind("<Motion>", self.show_pointer)
+        self.canvas.bind("<Motion>", lambda e: self.hover.push(self.show_pointer, self.view_event(e)))
+        self.canvas.bind("<ButtonPress-2>", self.start_pan)
+        self.canvas.bind("<B2-Motion>", self.pan)
+        self.canvas.bind("<ButtonRelease-2>", self.end_pan)
+        self.canvas.bind("<Control-MouseWheel>", lambda e: self.zoom(1 if e.delta > 0 else -1, e))
+        self.canvas.bind("<Control-Button-4>", lambda e: self.zoom(1, e))
+        self.canvas.bind("<Control-Button-5>", lambda e: self.zoom(-1, e))
+        self.panning = False
 
         self.last_x, self.last_y = None, None
         self.start_x, self.start_y = None, None
 
-        self.image_tk = None
         self.temp_shape = None
         self.pointer = None
         self.tool_buttons = {}
@@ -63,13 +104,36 @@ class PaintApp:
         self.tool_row = 1
         self.tool_col = 0
 
-        self.selection_box = None
-        self.selection_image = None
-        self.selection_position = None
+        self.floating = None
         self.preview_image = None
+        self.preview_source = None
+        self.preview_item = None
+        self.stroke_item = None
+        self.stroke_item_points = []
+        self.stroke_flush = None
+        self.saver = saving.Saver()
+        self.tiles = TileExecutor()
+        self.canvas_job = None
+        self.canvas_poll = None
+        self.ignore_press = False
+        self.save_poll = None
+        self.journal_error = None
 
         self.setup_ui()
         self.update_canvas_image()
+        self.poll_journal()
+
+        self.root.bind("<Control-o>", lambda e: self.open_image())
+        self.root.bind("<Control-equal>", lambda e: self.zoom(1))
+        self.root.bind("<Control-minus>", lambda e: self.zoom(-1))
+        self.root.bind("<Control-z>", lambda e: self.undo())
+        self.root.bind("<Control-y>", lambda e: self.redo())
+        self.root.bind("<F3>", lambda e: self.overlay.toggle())
+        self.root.bind("<F4>", lambda e: self.dump_profile())
+        self.root.bind("<Return>", lambda e: self.commit_selection())
+        self.root.bind("<Escape>", lambda e: self.cancel())
+        if os.environ.get("SIMPLE_PAINT_PROFILE"):
+            self.overlay.show()
 
     def setup_ui(self):
         frame = self.toolbar
@@ -88,10 +152,16 @@ class PaintApp:
 
         add_button("Color", self.choose_color)
         add_button("Clear", self.clear_canvas)
+        add_button("Open", self.open_image)
         add_button("Save", self.save_image)
+        add_button("Zoom +", lambda: self.zoom(1))
+        add_button("Zoom -", lambda: self.zoom(-1))
         add_button("Undo", self.undo)
+        add_button("Redo", self.redo)
         add_button("Rotate", self.rotate_image)
         add_button("Rotate Selection", self.rotate_selection)
+        add_button("Scale Selection", self.scale_selection)
+        add_button("Flip Selection", self.flip_selection)
         add_button("Flip H", self.flip_horizontal)
         add_button("Flip V", self.flip_vertical)
 
@@ -109,21 +179,85 @@ class PaintApp:
         tk.Spinbox(frame, from_=1, to=50, textvariable=self.size_var, width=5, 
                    command=self.update_pen_size).grid(row=self.tool_row, column=0, columnspan=2, pady=5)
 
+        self.tool_row += 1
+        tk.Label(frame, text="Sudut / Skala %").grid(row=self.tool_row, column=0, columnspan=2, pady=(10, 0))
+        self.tool_row += 1
+        self.angle_var = tk.IntVar(value=90)
+        tk.Spinbox(frame, from_=-360, to=360, textvariable=self.angle_var, width=5
+                   ).grid(row=self.tool_row, column=0, pady=5)
+        self.scale_var = tk.IntVar(value=150)
+        tk.Spinbox(frame, from_=10, to=400, increment=10, textvariable=self.scale_var, width=5
+                   ).grid(row=self.tool_row, column=1, pady=5)
+
+        self.tool_row += 1
+        tk.Label(frame, text="Toleransi Fill").grid(row=self.tool_row, column=0, columnspan=2, pady=(10, 0))
+        self.tool_row += 1
+        self.tolerance_var = tk.IntVar(value=self.fill_tolerance)
+        tk.Spinbox(frame, from_=0, to=255, textvariable=self.tolerance_var, width=5,
+                   command=self.update_fill_options).grid(row=self.tool_row, column=0, pady=5)
+        self.connectivity_var = tk.IntVar(value=self.fill_connectivity)
+        tk.Checkbutton(frame, text="8-arah", variable=self.connectivity_var, onvalue=8, offvalue=4,
+                       command=self.update_fill_options).grid(row=self.tool_row, column=1, pady=5)
+
+        self.tool_row += 1
+        tk.Label(frame, text="Kualitas / Kompresi").grid(row=self.tool_row, column=0, columnspan=2, pady=(10, 0))
+        self.tool_row += 1
+        self.quality_var = tk.IntVar(value=self.save_quality)
+        tk.Spinbox(frame, from_=1, to=100, textvariable=self.quality_var, width=5,
+                   command=self.update_save_options).grid(row=self.tool_row, column=0, pady=5)
+        self.compress_var = tk.IntVar(value=self.save_compress_level)
+        tk.Spinbox(frame, from_=0, to=9, textvariable=self.compress_var, width=5,
+                   command=self.update_save_options).grid(row=self.tool_row, column=1, pady=5)
+        self.tool_row += 1
+        self.optimize_var = tk.IntVar(value=int(self.save_optimize))
+        tk.Checkbutton(frame, text="Optimize", variable=self.optimize_var,
+                       command=self.update_save_options).grid(row=self.tool_row, column=0, columnspan=2)
+        self.tool_row += 1
+        self.save_status = tk.Label(frame, text="", anchor="w")
+        self.save_status.grid(row=self.tool_row, column=0, columnspan=2, sticky="ew")
+        self.tool_row += 1
+        self.zoom_label = tk.Label(frame, text="100%")
+        self.zoom_label.grid(row=self.tool_row, column=0, columnspan=2)
+
+        self.tool_row += 1
+        tk.Label(frame, text="Layer").grid(row=self.tool_row, column=0, columnspan=2, pady=(10, 0))
+        self.tool_row += 1
+        self.layer_list = tk.Listbox(frame, height=4, exportselection=False)
+        self.layer_list.grid(row=self.tool_row, column=0, columnspan=2, sticky="ew")
+        self.layer_list.bind("<<ListboxSelect>>", self.on_layer_select)
+        self.tool_row += 1
+        tk.Button(frame, text="Layer +", width=12,
+                  command=self.add_layer).grid(row=self.tool_row, column=0, padx=2, pady=2)
+        tk.Button(frame, text="Layer -", width=12,
+                  command=self.remove_layer).grid(row=self.tool_row, column=1, padx=2, pady=2)
+        self.tool_row += 1
+        self.layer_visible_var = tk.IntVar(value=1)
+        tk.Checkbutton(frame, text="Tampil", variable=self.layer_visible_var,
+                       command=self.update_layer).grid(row=self.tool_row, column=0)
+        self.opacity_var = tk.IntVar(value=100)
+        tk.Spinbox(frame, from_=0, to=100, textvariable=self.opacity_var, width=5,
+                   command=self.update_layer).grid(row=self.tool_row, column=1, pady=5)
+        self.tool_row += 1
+        self.blend_var = tk.StringVar(value="normal")
+        tk.OptionMenu(frame, self.blend_var, *BLENDS,
+                      command=lambda _: self.update_layer()).grid(row=self.tool_row, column=0, columnspan=2)
+        self.refresh_layer_list()
+
         self.update_tool_highlight()
 
     def on_canvas_resize(self, event):
         new_width = max(event.width, 1)
         new_height = max(event.height, 1)
         if new_width > self.canvas_width or new_height > self.canvas_height:
-            old_image = self.image
-            self.canvas_width = new_width
-            self.canvas_height = new_height
-            self.image = Image.new("RGB", (self.canvas_width, self.canvas_height), "white")
-            self.image.paste(old_image, (0, 0))
-            self.draw = ImageDraw.Draw(self.image)
+            self.canvas_width = max(new_width, self.canvas_width)
+            self.canvas_height = max(new_height, self.canvas_height)
+            self.document.layers.resize((self.canvas_width, self.canvas_height))
+            self.journal.resize((self.canvas_width, self.canvas_height))
             self.update_canvas_image()
 
     def set_tool(self, tool):
+        if tool != self.tool:
+            self.commit_selection()
         self.tool = tool
         self.current_tool = tool
         self.update_tool_highlight()
@@ -142,30 +276,112 @@ class PaintApp:
     def update_pen_size(self):
         self.pen_size = self.size_var.get()
 
+    def update_fill_options(self):
+        self.fill_tolerance = self.tolerance_var.get()
+        self.fill_connectivity = self.connectivity_var.get()
+
+    def update_save_options(self):
+        self.save_quality = self.quality_var.get()
+        self.save_compress_level = self.compress_var.get()
+        self.save_optimize = bool(self.optimize_var.get())
+
+    def refresh_layer_list(self):
+        layers = self.document.layers
+        self.layer_list.delete(0, tk.END)
+        # Top layer first, the way it stacks on the canvas.
+        for layer in reversed(layers.layers):
+            self.layer_list.insert(tk.END, layer.name if layer.visible else f"({layer.name})")
+        self.layer_list.selection_set(len(layers.layers) - 1 - layers.active)
+        current = layers.current
+        self.layer_visible_var.set(int(current.visible))
+        self.opacity_var.set(round(current.opacity * 100))
+        self.blend_var.set(current.blend)
+
+    def on_layer_select(self, event):
+        selection = self.layer_list.curselection()
+        if selection:
+            # A floating selection lands on the layer it was lifted from.
+            self.commit_selection()
+            count = len(self.document.layers.layers)
+            self.document.apply(commands.SelectLayer(count - 1 - selection[0]))
+            self.refresh_layer_list()
+
+    def add_layer(self):
+        self.commit_selection()
+        self.document.apply(commands.AddLayer())
+        self.refresh_layer_list()
+
+    def remove_layer(self):
+        self.commit_selection()
+        box = self.document.apply(commands.RemoveLayer(self.document.layers.active))
+        self.refresh_layer_list()
+        self.update_canvas_image(box)
+
+    def update_layer(self):
+        box = self.document.apply(commands.LayerProperties(self.document.layers.active,
+                                                           bool(self.layer_visible_var.get()),
+                                                           self.opacity_var.get() / 100,
+                                                           self.blend_var.get()))
+        self.refresh_layer_list()
+        self.update_canvas_image(box)
+
+    @timed("on_press", events=True)
     def on_press(self, event):
+        self.motion.cancel()
+        # Nothing is drawn while a whole-canvas job is working from a snapshot of the layer.
+        self.ignore_press = self.canvas_job is not None
+        # A left press only pans below 100%, whatever the middle button did before it.
+        self.panning = False
+        if self.ignore_press:
+            return
+        if self.display.level > 0:
+            # Below 100% the left button pans; drawing happens at full resolution.
+            self.start_pan(event)
+            return
+        self.view_event(event)
         self.start_x, self.start_y = event.x, event.y
-        self.save_state()
         if self.tool == "fill":
             self.flood_fill(event.x, event.y)
         elif self.tool in ["pencil", "eraser"]:
             self.last_x, self.last_y = event.x, event.y
+            # Erasing restores the layer's own background: white at the bottom, clear above.
+            color = self.document.image.background if self.tool == "eraser" else self.pen_color
+            self.document.begin_stroke(event.x, event.y, color, self.pen_size)
+            self.stroke_item = None
+            self.stroke_item_points = [event.x, event.y]
+        elif self.tool == "selectAndmove" and self.floating:
+            # Grabbing the floating pixels keeps the cursor at the same spot on them.
+            x0, y0 = self.floating.box[0] + self.floating.dx, self.floating.box[1] + self.floating.dy
+            self.drag_data["grab"] = (event.x - x0, event.y - y0)
+            self.canvas.bind("<B1-Motion>", self.on_drag)
         elif self.tool in ["selectAndmove", "cursor"]:
             self.select_start = (event.x, event.y)
             self.selection_rect = self.canvas.create_rectangle(event.x, event.y, event.x, event.y,
-                                                                outline="blue", dash=(2, 2))
+                                                                outline="blue", dash=(2, 2),
+                                                                tags="selection")
             self.selected_items = []
             self.canvas.bind("<B1-Motion>", self.on_drag)
 
+    @timed("on_drag", events=True)
     def on_drag(self, event):
+        if self.ignore_press:
+            return
+        if self.panning:
+            self.pan(event)
+            return
+        self.view_event(event)
+        self.motion.push(self.drag_motion, event)
+
+    @timed("motion.drag")
+    def drag_motion(self, event):
         if self.tool == "selectAndmove":
-            if self.selection_box and self.selection_image:
-                dx = event.x - self.selection_position[0]
-                dy = event.y - self.selection_position[1]
-                self.update_canvas_image()
-                self.preview_image = ImageTk.PhotoImage(self.selection_image)
-                self.canvas.create_image(event.x, event.y, image=self.preview_image, anchor=tk.NW)
-                self.drag_data["dx"] = dx
-                self.drag_data["dy"] = dy
+            if self.floating and "grab" in self.drag_data:
+                gx, gy = self.drag_data["grab"]
+                self.floating.move_to(event.x - gx, event.y - gy)
+                self.show_preview()
+            elif self.selection_rect:
+                x0, y0 = self.select_start
+                self.canvas.coords(self.selection_rect, x0, y0, event.x, event.y)
         elif self.tool == "cursor":
             if self.selection_rect:
                 x0, y0 = self.select_start
@@ -178,12 +394,24 @@ class PaintApp:
                 self.drag_data["x"] = event.x
                 self.drag_data["y"] = event.y
 
+    @timed("on_release", events=True)
     def on_release(self, event):
+        # The last coalesced motion is handled first so the release sees the final state.
+        self.motion.flush()
+        if self.ignore_press:
+            self.ignore_press = False
+            return
+        if self.panning:
+            self.panning = False
+            return
+        self.view_event(event)
         if self.tool == "cursor":
             if self.selection_rect:
                 x0, y0, x1, y1 = self.canvas.coords(self.selection_rect)
-                self.selected_items = self.canvas.find_enclosed(min(x0, x1), min(y0, y1),
-                                                                 max(x0, x1), max(y0, y1))
+                enclosed = self.canvas.find_enclosed(min(x0, x1), min(y0, y1),
+                                                     max(x0, x1), max(y0, y1))
+                self.selected_items = [item for item in enclosed
+                                       if not {"display", "overlay"} & set(self.canvas.gettags(item))]
                 self.canvas.delete(self.selection_rect)
                 self.selection_rect = None
                 self.select_start = None
@@ -191,290 +419,364 @@ class PaintApp:
                     self.drag_data["x"] = event.x
                     self.drag_data["y"] = event.y
         elif self.temp_shape:
-            self.canvas.delete(self.temp_shape)
+            self.canvas.delete("shape_preview")
             self.temp_shape = None
 
+        if self.tool in ["pencil", "eraser"] and self.document.stroke:
+            self.flush_stroke()
+            box = self.document.end_stroke()
+            if box:
+                self.display.discard("stroke")
+                self.update_canvas_image(box)
+            self.stroke_item = None
+
         if self.tool == "selectAndmove":
-            if self.selection_rect and not self.selection_box:
+            if self.floating and "grab" in self.drag_data:
+                gx, gy = self.drag_data.pop("grab")
+                self.floating.move_to(event.x - gx, event.y - gy)
+                self.commit_selection()
+            elif self.selection_rect:
                 x0, y0 = self.select_start
                 x1, y1 = event.x, event.y
                 self.canvas.coords(self.selection_rect, x0, y0, x1, y1)
-                self.selection_box = (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
-                self.selection_image = self.image.crop(self.selection_box)
-                self.selection_position = (self.selection_box[0], self.selection_box[1])
-                self.selection_active = True
-            elif self.selection_box and self.selection_image:
-                dx = event.x - self.selection_position[0]
-                dy = event.y - self.selection_position[1]
-                self.update_canvas_image()
-                self.preview_image = ImageTk.PhotoImage(self.selection_image)
-                self.canvas.create_image(event.x, event.y, image=self.preview_image, anchor=tk.NW)
-                self.drag_data["dx"] = dx
-                self.drag_data["dy"] = dy
-
-            if self.selection_image and ("dx" in self.drag_data or "dy" in self.drag_data):
-                self.save_state()
-                dx, dy = self.drag_data["dx"], self.drag_data["dy"]
-                x0 = self.selection_box[0] + dx
-                y0 = self.selection_box[1] + dy
-                x_old0, y_old0, x_old1, y_old1 = self.selection_box
-                self.draw.rectangle([x_old0, y_old0, x_old1, y_old1], fill="white")
-                self.image.paste(self.selection_image, (x0, y0))
-                self.draw = ImageDraw.Draw(self.image)
-                self.update_canvas_image()
-                self.selection_box = None
-                self.selection_image = None
-                self.selection_position = None
-                self.preview_image = None
-                self.drag_data.clear()
-                self.selection_active = False
-
-        if self.tool in ["line", "line_bresenham", "rectangle", "oval", "circle_midpoint",
-                         "circle", "triangle", "rectangle3d", "circle3d", "triangle3d"]:
-            x0, y0 = self.start_x, self.start_y
-            x1, y1 = event.x, event.y
-
-            if self.tool == "line":
-                self.draw.line((x0, y0, x1, y1), fill=self.pen_color, width=self.pen_size)  
-            elif self.tool == "line_bresenham":
-                self.draw_line_bresenham(x0, y0, x1, y1, self.pen_color)
-            elif self.tool == "rectangle":
-                self.draw.rectangle((x0, y0, x1, y1), outline=self.pen_color, width=self.pen_size)
-            elif self.tool == "oval":
-                self.draw.ellipse((x0, y0, x1, y1), outline=self.pen_color, width=self.pen_size)
-            elif self.tool == "circle_midpoint":
-                xc = (x0 + x1) // 2
-                yc = (y0 + y1) // 2
-                r = max(abs(x1 - x0), abs(y1 - y0)) // 2
-                self.draw_circle_midpoint(xc, yc, r, self.pen_color)
-            elif self.tool == "circle":
-                r = max(abs(x1 - x0), abs(y1 - y0))
-                self.draw.ellipse((x0 - r, y0 - r, x0 + r, y0 + r), outline=self.pen_color, width=self.pen_size)
-            elif self.tool == "triangle":
-                points = [x0, y1, (x0 + x1) // 2, y0, x1, y1]
-                self.draw.polygon(points, outline=self.pen_color, width=self.pen_size)
-            elif self.tool == "rectangle3d":
-                offset = 10
-                self.draw.rectangle((x0, y0, x1, y1), fill=self.pen_color,
-                                    outline=self.pen_color, width=self.pen_size)
-                shadow_color = "gray"
-                self.draw.rectangle((x0 + offset, y0 - offset, x1 + offset, y1 - offset),
-                                    fill=shadow_color, outline=shadow_color)
-                self.draw.polygon([(x0, y0), (x0 + offset, y0 - offset),
-                                   (x0 + offset, y1 - offset), (x0, y1)],
-                                  fill="darkgray")
-                self.draw.polygon([(x1, y0), (x1 + offset, y0 - offset),
-                                   (x1 + offset, y1 - offset), (x1, y1)],
-                                  fill="darkgray")
-            elif self.tool == "circle3d":
-                r = max(abs(x1 - x0), abs(y1 - y0))
-                self.draw.ellipse((x0 - r, y0 - r, x0 + r, y0 + r), fill=self.pen_color,
-                                  outline=self.pen_color, width=self.pen_size)
-                self.draw.ellipse((x0 - r + 5, y0 - r - 5, x0 + r + 5, y0 + r - 5),
-                                  fill="gray", outline="gray", width=1)
-            elif self.tool == "triangle3d":
-                base_points = [x0, y1, (x0 + x1) // 2, y0, x1, y1]
-                shadow_offset = 10
-                shadow_points = [
-                    x0 + shadow_offset, y1 - shadow_offset,
-                    (x0 + x1) // 2 + shadow_offset, y0 - shadow_offset,
-                    x1 + shadow_offset, y1 - shadow_offset
-                ]
-                self.draw.polygon(base_points, fill=self.pen_color, outline=self.pen_color)
-                self.draw.polygon(shadow_points, fill="gray", outline="gray")
-                for (x_base, y_base), (x_shadow, y_shadow) in zip(
-                    [(x0, y1), ((x0 + x1) // 2, y0), (x1, y1)],
-                    [(x0 + shadow_offset, y1 - shadow_offset),
-                     ((x0 + x1) // 2 + shadow_offset, y0 - shadow_offset),
-                     (x1 + shadow_offset, y1 - shadow_offset)]
-                ):
-                    self.draw.line((x_base, y_base, x_shadow, y_shadow), fill="darkgray")
-
-            self.update_canvas_image()
+                box = (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+                self.selection_rect = None
+                if box[2] > box[0] and box[3] > box[1]:
+                    # Nothing is copied yet; the pixels are read when a preview needs them.
+                    self.floating = FloatingSelection(self.document.image, box)
+                    self.selection_active = True
+                else:
+                    self.canvas.delete("selection")
+
+        if self.tool in commands.SHAPE_TOOLS:
+            box = self.document.apply(commands.Shape(self.tool, self.start_x, self.start_y,
+                                                     event.x, event.y, self.pen_color, self.pen_size))
+            self.update_canvas_image(box)
         self.canvas.bind("<B1-Motion>", self.paint)
 
+    @timed("flush_stroke")
+    def flush_stroke(self):
+        if self.stroke_flush is not None:
+            self.root.after_cancel(self.stroke_flush)
+            self.stroke_flush = None
+        self.document.flush_stroke()
+
+    def show_preview(self):
+        # A new PhotoImage only when the transform changed; a plain move just shifts the item.
+        image, (x, y) = self.floating.preview()
+        if image is not self.preview_source:
+            self.preview_source = image
+            self.preview_image = ImageTk.PhotoImage(image)
+            if self.preview_item is not None:
+                self.canvas.itemconfig(self.preview_item, image=self.preview_image)
+        if self.preview_item is None:
+            self.canvas.delete("selection")
+            self.preview_item = self.canvas.create_image(x, y, image=self.preview_image, anchor=tk.NW,
+                                                         tags="preview")
+        else:
+            self.canvas.coords(self.preview_item, x, y)
+
+    def hide_preview(self):
+        if self.preview_item is not None:
+            self.display.discard("preview")
+        self.preview_item = None
+        self.preview_image = None
+        self.preview_source = None
+
+    def commit_selection(self):
+        floating = self.floating
+        self.cancel_selection()
+        if floating and not floating.is_identity():
+            box = self.document.apply(floating.command())
+            self.update_canvas_image(box)
+
+    def cancel_selection(self):
+        self.hide_preview()
+        self.canvas.delete("selection")
+        self.floating = None
+        self.selection_active = False
+        self.drag_data.pop("grab", None)
+
+    @timed("paint", events=True)
     def paint(self, event):
-        if self.tool in ["pencil", "eraser"]:
+        if self.ignore_press:
+            return
+        if self.panning:
+            self.pan(event)
+            return
+        self.view_event(event)
+        if self.tool in ["pencil", "eraser"] and self.document.stroke:
+            # Every point goes into the stroke; only the canvas preview is coalesced.
+            self.document.extend_stroke(event.x, event.y)
+            self.stroke_item_points += [event.x, event.y]
+        self.motion.push(self.paint_motion, event)
+
+    def stroke_style(self):
+        if self.tool != "eraser":
+            return {"fill": self.pen_color}
+        # The eraser writes the layer background. Erasing to transparency reveals the layers
+        # below, which only the flushed stroke can show, so the preview just marks the path.
+        r, g, b, a = colors.rgba(self.document.image.background)
+        if a < 255:
+            return {"fill": "gray", "stipple": "gray25"}
+        return {"fill": f"#{r:02x}{g:02x}{b:02x}"}
+
+    @timed("motion.paint")
+    def paint_motion(self, event):
+        if self.tool in ["pencil", "eraser"] and self.document.stroke:
             x, y = event.x, event.y
-            color = "white" if self.tool == "eraser" else self.pen_color
-            self.canvas.create_line(self.last_x, self.last_y, x, y, fill=color, width=self.pen_size)
-            self.draw.line([self.last_x, self.last_y, x, y], fill=color, width=self.pen_size)
+            if self.stroke_item is None:
+                self.stroke_item = self.canvas.create_line(*self.stroke_item_points,
+                                                           width=self.pen_size, capstyle=tk.ROUND,
+                                                           joinstyle=tk.ROUND, tags="stroke",
+                                                           **self.stroke_style())
+            else:
+                self.canvas.coords(self.stroke_item, *self.stroke_item_points)
+            if len(self.stroke_item_points) > 2048:
+                # Keep each coords() update short on very long strokes.
+                self.stroke_item = None
+                self.stroke_item_points = [x, y]
+            if self.stroke_flush is None:
+                self.stroke_flush = self.root.after(16, self.flush_stroke)
             self.last_x, self.last_y = x, y
-        elif self.tool in ["line", "rectangle", "oval", "circle", "triangle"]:
+        elif self.tool in commands.SHAPE_TOOLS:
+            items = shapes.outline(self.tool, self.start_x, self.start_y, event.x, event.y,
+                                   self.pen_size)
+            # The preview items are created once per drag and then only moved.
             if self.temp_shape:
-                self.canvas.delete(self.temp_shape)
-            x0, y0 = self.start_x, self.start_y
-            x1, y1 = event.x, event.y
-            if self.tool == "line":
-                self.temp_shape = self.canvas.create_line(x0, y0, x1, y1, fill="gray", dash=(4, 2))
-            elif self.tool == "rectangle":
-                self.temp_shape = self.canvas.create_rectangle(x0, y0, x1, y1, outline="gray", dash=(4, 2))
-            elif self.tool == "oval":
-                self.temp_shape = self.canvas.create_oval(x0, y0, x1, y1, outline="gray", dash=(4, 2))
-            elif self.tool == "circle":
-                r = max(abs(x1 - x0), abs(y1 - y0))
-                self.temp_shape = self.canvas.create_oval(x0 - r, y0 - r, x0 + r, y0 + r, outline="gray", dash=(4, 2))
-            elif self.tool == "triangle":
-                points = [x0, y1, (x0 + x1) // 2, y0, x1, y1]
-                self.temp_shape = self.canvas.create_polygon(points, outline="gray", dash=(4, 2), fill="")
+                for item, (_, coords) in zip(self.temp_shape, items):
+                    self.canvas.coords(item, *coords)
+                return
+            self.temp_shape = []
+            for kind, coords in items:
+                if kind == "line":
+                    item = self.canvas.create_line(*coords, fill="gray", dash=(4, 2), tags="shape_preview")
+                else:
+                    create = getattr(self.canvas, "create_" + kind)
+                    item = create(*coords, outline="gray", dash=(4, 2), fill="", tags="shape_preview")
+                self.temp_shape.append(item)
 
     def flood_fill(self, x, y):
-        if not (0 <= x < self.canvas_width and 0 <= y < self.canvas_height):
-            return
-        target_color = self.image.getpixel((x, y))
-        replacement_color = self.hex_to_rgb(self.pen_color)
-        if target_color == replacement_color:
-            return
-        pixel = self.image.load()
-        stack = [(x, y)]
-        while stack:
-            cx, cy = stack.pop()
-            try:
-                if pixel[cx, cy] == target_color:
-                    pixel[cx, cy] = replacement_color
-                    stack.extend([(cx + 1, cy), (cx - 1, cy), (cx, cy + 1), (cx, cy - 1)])
-            except IndexError:
-                continue
-        self.update_canvas_image()
+        box = self.document.apply(commands.Fill(x, y, self.pen_color,
+                                                self.fill_tolerance, self.fill_connectivity))
+        if box:
+            self.update_canvas_image(box)
 
     def rotate_image(self):
-        self.save_state()
-        rotated = self.image.rotate(-90, expand=True)
-        new_canvas = Image.new("RGB", (self.canvas_width, self.canvas_height), "white")
-        rotated_width, rotated_height = rotated.size
-        center_x = (self.canvas_width - rotated_width) // 2
-        center_y = (self.canvas_height - rotated_height) // 2
-        new_canvas.paste(rotated, (center_x, center_y))
-        self.image = new_canvas
-        self.draw = ImageDraw.Draw(self.image)
-        self.update_canvas_image()
-        
+        self.run_canvas_op(commands.Rotate())
+
     def rotate_selection(self):
-        if not self.selection_active or not self.selection_box or not self.selection_image:
+        if not self.floating:
             print("Tidak ada seleksi aktif untuk diputar.")
             return
-        
-        self.save_state()
-        rotated_image = self.selection_image.rotate(-90, expand=True)
-        w, h = rotated_image.size
-        x0, y0 = self.selection_box[0], self.selection_box[1]
-
-        x_old0, y_old0, x_old1, y_old1 = self.selection_box
-        self.draw.rectangle([x_old0, y_old0, x_old1, y_old1], fill="white")
-        self.image.paste(rotated_image, (x0, y0))
-        self.draw = ImageDraw.Draw(self.image)
-
-        self.selection_box = None
-        self.selection_image = None
-        self.selection_position = None
-        self.preview_image = None
-        self.selection_active = False
-        self.update_canvas_image()
+        self.floating.rotate(self.angle_var.get())
+        self.show_preview()
+
+    def scale_selection(self):
+        if not self.floating:
+            print("Tidak ada seleksi aktif untuk diskalakan.")
+            return
+        self.floating.scale(self.scale_var.get() / 100)
+        self.show_preview()
+
+    def flip_selection(self):
+        if not self.floating:
+            print("Tidak ada seleksi aktif untuk dibalik.")
+            return
+        self.floating.flip()
+        self.show_preview()
 
     def flip_horizontal(self):
-        self.save_state()
-        self.image = self.image.transpose(Image.FLIP_LEFT_RIGHT)
-        self.draw = ImageDraw.Draw(self.image)
-        self.update_canvas_image()
+        self.run_canvas_op(commands.Flip("horizontal"))
 
     def flip_vertical(self):
-        self.save_state()
-        self.image = self.image.transpose(Image.FLIP_TOP_BOTTOM)
-        self.draw = ImageDraw.Draw(self.image)
-        self.update_canvas_image()
+        self.run_canvas_op(commands.Flip("vertical"))
+
+    def run_canvas_op(self, command):
+        if self.canvas_job is not None:
+            print("Masih memproses operasi kanvas sebelumnya.")
+            return
+        self.commit_selection()
+        if isinstance(command, (commands.Undo, commands.Redo)):
+            method = self.document.transpose_method(command)
+        else:
+            method = self.document.renderer.transpose_method(command, self.document.image)
+        if method is None:
+            box = self.document.apply(command)
+            if box:
+                self.update_canvas_image(box)
+            return
+        # Tiles are transposed on worker threads; the result is applied once all are done,
+        # unless the layer changed in the meantime.
+        job = self.tiles.transpose(self.document.image, method, on_done=self.canvas_op_finished,
+                                   on_progress=self.canvas_op_progress)
+        self.canvas_job = (job, command, self.document.image, len(self.document.log))
+        self.poll_canvas_job()
+
+    def poll_canvas_job(self):
+        self.canvas_poll = None
+        if self.tiles.poll():
+            self.canvas_poll = self.root.after(15, self.poll_canvas_job)
+
+    def canvas_op_progress(self, job):
+        self.save_status.config(text=f"Memproses {commands.kind(self.canvas_job[1])} "
+                                     f"{job.progress() * 100:.0f}%")
+
+    def canvas_op_finished(self, job):
+        _, command, source, logged = self.canvas_job
+        self.canvas_job = None
+        if job.cancelled:
+            self.save_status.config(text="Dibatalkan")
+        elif job.error is not None:
+            self.save_status.config(text=f"Gagal: {job.error}")
+        elif self.document.image is not source or len(self.document.log) != logged:
+            self.save_status.config(text="Dibatalkan: kanvas berubah")
+        else:
+            self.save_status.config(text="")
+            self.document.apply(command, job.result)
+            self.update_canvas_image()
+
+    def cancel(self):
+        if self.canvas_job is not None:
+            self.canvas_job[0].cancel()
+        self.cancel_selection()
 
     def show_pointer(self, event):
         if self.pointer:
             self.canvas.delete(self.pointer)
-        if self.tool in ["pencil", "eraser"]:
+            self.pointer = None
+        if self.tool in ["pencil", "eraser"] and self.display.level == 0:
             r = self.pen_size // 2
             self.pointer = self.canvas.create_oval(event.x - r, event.y - r,
                                                    event.x + r, event.y + r,
                                                    outline="gray", width=1)
 
-    def update_canvas_image(self):
-        self.canvas.delete("all")
-        self.image_tk = ImageTk.PhotoImage(self.image)
-        self.canvas.create_image(0, 0, anchor=tk.NW, image=self.image_tk)
-        self.preview_image = None
+    def view_event(self, event):
+        # Widget coordinates to canvas coordinates, which follow the scroll position.
+        event.x, event.y = self.display.to_canvas(event.x, event.y)
+        return event
+
+    def start_pan(self, event):
+        self.panning = True
+        self.canvas.scan_mark(event.x, event.y)
+
+    def pan(self, event):
+        self.canvas.scan_dragto(event.x, event.y, gain=1)
+        self.display.scrolled()
+
+    def end_pan(self, event):
+        self.panning = False
+
+    def zoom(self, steps, event=None):
+        # Each step halves or doubles the scale; levels below 100% come from the pyramid.
+        self.commit_selection()
+        self.canvas.delete("!display")
+        self.temp_shape = self.pointer = None
+        anchor = (event.x, event.y) if event is not None else None
+        self.display.set_level(self.display.level - steps, anchor)
+        self.zoom_label.config(text=f"{100 / self.display.scale:g}%")
+
+    def open_image(self):
+        file_path = filedialog.askopenfilename(filetypes=opening.FILETYPES)
+        if not file_path:
+            return
+        if self.canvas_job is not None:
+            print("Masih memproses operasi kanvas sebelumnya.")
+            return
+        self.cancel_selection()
+        start = time.perf_counter()
+        try:
+            document, proxy, factor = opening.open_document(file_path, self.display.viewport_size())
+        except OSError as error:
+            self.save_status.config(text=f"Gagal membuka: {error}")
+            return
+        self.canvas.delete("!display")
+        self.temp_shape = self.pointer = None
+        self.document = document
+        self.canvas_width, self.canvas_height = document.size
+        self.journal.close(discard=True)
+        self.journal = journal.Journal(self.journal.directory)
+        self.journal.attach(document, opened=file_path)
+        # Zoomed to fit, showing the proxy; full-resolution tiles load as they are needed.
+        self.display.show(document.layers, proxy, factor)
+        self.zoom_label.config(text=f"{100 / self.display.scale:g}%")
+        self.refresh_layer_list()
+        elapsed = (time.perf_counter() - start) * 1000
+        self.save_status.config(text=f"Dibuka: {os.path.basename(file_path)} "
+                                     f"{document.size[0]}x{document.size[1]} ({elapsed:.0f} ms)")
+
+    @timed("update_canvas_image")
+    def update_canvas_image(self, box=None):
+        self.display.update(self.document.layers, box)
 
     def clear_canvas(self):
-        self.save_state()
-        self.canvas.delete("all")
-        self.image = Image.new("RGB", (self.canvas_width, self.canvas_height), "white")
-        self.draw = ImageDraw.Draw(self.image)
+        self.commit_selection()
+        self.canvas.delete("!display")
+        self.document.apply(commands.Clear())
         self.update_canvas_image()
 
     def save_image(self):
         file_path = filedialog.asksaveasfilename(defaultextension=".png",
                                                    filetypes=[("PNG files", "*.png"),
                                                               ("JPEG files", "*.jpg;*.jpeg"),
+                                                              ("WebP files", "*.webp"),
                                                               ("All files", "*.*")])
         if file_path:
-            ext = file_path.lower().split('.')[-1]
-            if ext in ["jpg", "jpeg"]:
-                rgb_image = self.image.convert("RGB")
-                rgb_image.save(file_path, format="JPEG")
-            else:
-                self.image.save(file_path)
-
-    def save_state(self):
-        self.undo_stack.append(copy.deepcopy(self.image))
+            try:
+                fmt = saving.format_for(file_path)
+            except ValueError as error:
+                self.save_status.config(text=f"Gagal menyimpan: {error}")
+                return
+            options = saving.encoder_options(fmt, self.save_compress_level,
+                                             self.save_optimize, self.save_quality)
+            # Only the snapshot happens here; encoding runs while editing continues.
+            self.saver.save(self.document.layers, file_path, fmt, on_done=self.save_finished, **options)
+            self.journal.saved(file_path)
+            if self.save_poll is None:
+                self.poll_saves()
+
+    def poll_saves(self):
+        self.save_poll = None
+        if self.saver.poll():
+            running = self.saver.progress()
+            waiting = len(self.saver.pending)
+            text = ", ".join(f"{os.path.basename(path)} {written // 1024} KB" for path, _, written in running)
+            self.save_status.config(text=f"Menyimpan {text}" + (f" (+{waiting} antre)" if waiting else ""))
+            self.save_poll = self.root.after(100, self.poll_saves)
+
+    def save_finished(self, job):
+        if job.error is not None:
+            self.save_status.config(text=f"Gagal menyimpan: {job.error}")
+        else:
+            self.save_status.config(text=f"Tersimpan: {os.path.basename(job.path)}")
+
+    def dump_profile(self):
+        path = profiler.dump(time.strftime("profil-%Y%m%d-%H%M%S.json"))
+        print(f"Profil disimpan ke {path}")
+
+    def poll_journal(self):
+        # The writer thread only records its failures; each new one is shown here, so a
+        # journal that stopped writing does not go unnoticed.
+        error = self.journal.error
+        if error is not None and error is not self.journal_error:
+            self.journal_error = error
+            self.save_status.config(text=f"Jurnal gagal ditulis: {error}")
+        self.root.after(1000, self.poll_journal)
+
+    def on_close(self):
+        self.tiles.shutdown()
+        self.saver.shutdown()
+        self.journal.close(discard=True)
+        self.root.destroy()
 
     def undo(self):
-        if self.undo_stack:
-            self.image = self.undo_stack.pop()
-            self.draw = ImageDraw.Draw(self.image)
-            self.update_canvas_image()
+        # Undoing a flip or rotation is itself a whole-canvas transpose.
+        self.cancel_selection()
+        self.run_canvas_op(commands.Undo())
 
-    def hex_to_rgb(self, color):
-        if color.startswith('#'):
-            color = color.lstrip('#')
-            return tuple(int(color[i:i+2], 16) for i in (0,2,4))
-        else:
-            r, g, b = self.root.winfo_rgb(color)
-            return (r//256, g//256, b//256)
-
-    def draw_line_bresenham(self, x0, y0, x1, y1, color):
-        dx = abs(x1 - x0)
-        dy = abs(y1 - y0)
-        sx = 1 if x0 < x1 else -1
-        sy = 1 if y0 < y1 else -1
-        err = dx - dy
-        while True:
-            self.image.putpixel((x0, y0), self.hex_to_rgb(color))
-            if x0 == x1 and y0 == y1:
-                break
-            e2 = 2 * err
-            if e2 > -dy:
-                err -= dy
-                x0 += sx
-            if e2 < dx:
-                err += dx
-                y0 += sy
-
-    def draw_circle_midpoint(self, xc, yc, r, color):
-        x = 0
-        y = r
-        p = 1 - r
-        self._plot_circle_points(xc, yc, x, y, color)
-        while x < y:
-            x += 1
-            if p < 0:
-                p += 2 * x + 1
-            else:
-                y -= 1
-                p += 2 * (x - y) + 1
-            self._plot_circle_points(xc, yc, x, y, color)
-
-    def _plot_circle_points(self, xc, yc, x, y, color):
-        points = [
-            (xc+x, yc+y), (xc-x, yc+y), (xc+x, yc-y), (xc-x, yc-y),
-            (xc+y, yc+x), (xc-y, yc+x), (xc+y, yc-x), (xc-y, yc-x)
-        ]
-        for px, py in points:
-            if 0 <= px < self.canvas_width and 0 <= py < self.canvas_height:
-                self.image.putpixel((px, py), self.hex_to_rgb(color))
+    def redo(self):
+        self.cancel_selection()
+        self.run_canvas_op(commands.Redo())
 
 
 if __name__ == "__main__":